@@ -328,3 +328,76 @@ COMPRESS_URL = STATIC_URL
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# Publishing
+# ------------------------------------------------------------------------------
+# Fan pending notes out into per-user Celery tasks instead of publishing every
+# user serially inside the beat-driven task.
+PUBLISH_FANOUT = env.bool("PUBLISH_FANOUT", default=True)
+# Maximum number of per-user publish tasks dispatched by a single run. Users
+# are spread over these tasks when there are more users than the cap.
+PUBLISH_MAX_CONCURRENCY = env.int("PUBLISH_MAX_CONCURRENCY", default=8)
+# Number of relays that must acknowledge a Nostr event before it counts as
+# published, and how long to wait for the answer of each relay (seconds).
+NOSTR_RELAY_QUORUM = env.int("NOSTR_RELAY_QUORUM", default=2)
+NOSTR_RELAY_TIMEOUT = env.float("NOSTR_RELAY_TIMEOUT", default=5)
+# Number of due notes a publish task leases at once, and how long the lease
+# lasts before another task may take the notes over (seconds). The lease
+# outlives the hard time limit so a killed task never loses notes for good.
+PUBLISH_CLAIM_BATCH_SIZE = env.int("PUBLISH_CLAIM_BATCH_SIZE", default=500)
+PUBLISH_LEASE_SECONDS = env.int("PUBLISH_LEASE_SECONDS", default=CELERY_TASK_TIME_LIMIT)
+# Posts the X API allows per credentials ("user") and per app, as (requests,
+# window in seconds). They seed the rate limiter until X reports its own limits
+# in the response headers.
+X_RATE_LIMITS = {
+    "user": (env.int("X_RATE_LIMIT_PER_USER", default=100), 24 * 60 * 60),
+    "app": (env.int("X_RATE_LIMIT_PER_APP", default=1667), 24 * 60 * 60),
+}
+# Publish every note at its scheduled second from a Redis timer, polled by the
+# "Dispatch due notes" task. The minute task then only reconciles the timer
+# with the database instead of scanning for due notes itself.
+PUBLISH_TIMER = env.bool("PUBLISH_TIMER", default=True)
+# Consecutive failed deliveries after which a Nostr relay is left out, and for
+# how long (seconds) before it is tried again.
+RELAY_CIRCUIT_FAILURES = env.int("RELAY_CIRCUIT_FAILURES", default=3)
+RELAY_CIRCUIT_COOLDOWN = env.int("RELAY_CIRCUIT_COOLDOWN", default=60)
+# Relays every Nostr note is published to, on top of the user's own relays.
+NOSTR_DEFAULT_RELAYS = env.list(
+    "NOSTR_DEFAULT_RELAYS",
+    default=[
+        "wss://nostr-pub.wellorder.net",
+        "wss://relay.damus.io",
+        "wss://relay.snort.social",
+        "wss://relay.primal.net",
+    ],
+)
+# Number of claimed notes a publish task reads from the database at once, and
+# after which it delivers and stores their outcome.
+PUBLISH_CHUNK_SIZE = env.int("PUBLISH_CHUNK_SIZE", default=100)
+# Seconds the lease of a publish run outlives its last heartbeat. While a run
+# holds it, new ticks of "Dispatch due notes" or "Publish scheduled tweets" do
+# not start another one. Fanned-out runs only hold it while they dispatch.
+PUBLISH_RUN_LEASE_SECONDS = env.int("PUBLISH_RUN_LEASE_SECONDS", default=30)
+# Seconds a publish task works on its claimed notes before handing the rest to
+# a continuation task, leaving time to store the outcome before the soft limit.
+PUBLISH_TIME_BUDGET = env.int(
+    "PUBLISH_TIME_BUDGET", default=CELERY_TASK_SOFT_TIME_LIMIT - 20
+)
+# Notes of one user a publish run may have claimed at once, times the user's
+# weight. PUBLISH_PLAN_WEIGHTS maps the names of user groups (plans) to their
+# weight; users outside them weigh 1. A run publishes as many notes of each
+# user per round as their weight.
+PUBLISH_USER_INFLIGHT = env.int("PUBLISH_USER_INFLIGHT", default=20)
+PUBLISH_PLAN_WEIGHTS = env.dict("PUBLISH_PLAN_WEIGHTS", cast={"value": int}, default={})
+# Seconds past its scheduled time after which a due note leaves the "on time"
+# lane for the "late" one, and then for the "backlog" one. Each lane has its
+# own Celery queue, and backlog tasks together claim at most
+# PUBLISH_BACKLOG_BUDGET notes per minute so the backlog drains without
+# crowding out punctual notes.
+PUBLISH_LATE_AFTER = env.int("PUBLISH_LATE_AFTER", default=5 * 60)
+PUBLISH_BACKLOG_AFTER = env.int("PUBLISH_BACKLOG_AFTER", default=60 * 60)
+PUBLISH_BACKLOG_BUDGET = env.int("PUBLISH_BACKLOG_BUDGET", default=50)
+# The per-second dispatcher shares the queue of the on-time lane, so a busy
+# backlog never delays it.
+CELERY_TASK_ROUTES = {
+    "xedule.app.tasks.dispatch_due_notes": {"queue": "publish_on_time"},
+}
@@ -1,14 +1,17 @@
 # tweets/admin.py
 from django.contrib import admin
+from django.utils import timezone
 
+from .models import LeaseStats
 from .models import Note
+from .models import RelayHealth
 from .models import TwitterCredentials
 
 
 @admin.register(Note)
 class TweetAdmin(admin.ModelAdmin):
     list_display = ("content", "status", "scheduled_time", "created_at", "published_at")
-    list_filter = ("status", "created_at", "published_at")
+    list_filter = ("status", "error_code", "created_at", "published_at")
     search_fields = ("content",)
     readonly_fields = ("published_at", "tweet_id")
     actions = ["mark_as_pending"]
@@ -17,7 +20,17 @@ class TweetAdmin(admin.ModelAdmin):
         description="Marcar tweets seleccionados como pendientes",
     )
     def mark_as_pending(self, request, queryset):
-        queryset.update(status="pending", published_at=None, tweet_id=None)
+        queryset.update(
+            status="pending",
+            published_at=None,
+            tweet_id="",
+            attempts=0,
+            next_attempt_at=None,
+            last_error="",
+            error_code="",
+            claimed_by="",
+            claim_expires_at=None,
+        )
 
 
 @admin.register(TwitterCredentials)
@@ -25,3 +38,51 @@ class TwitterCredentialsAdmin(admin.ModelAdmin):
     list_display = ("user", "created_at", "updated_at")
     search_fields = ("user__username",)
     readonly_fields = ("created_at", "updated_at")
+
+
+@admin.register(RelayHealth)
+class RelayHealthAdmin(admin.ModelAdmin):
+    list_display = (
+        "url",
+        "circuit_open",
+        "failure_rate",
+        "ack_latency",
+        "connect_latency",
+        "consecutive_failures",
+        "last_delivery_at",
+    )
+    search_fields = ("url",)
+
+    @admin.display(boolean=True, description="Circuit open")
+    def circuit_open(self, obj):
+        return (
+            obj.circuit_open_until is not None
+            and obj.circuit_open_until > timezone.now()
+        )
+
+    # Los datos se copian de Redis, así que la vista es de solo lectura
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LeaseStats)
+class LeaseStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        "name",
+        "acquired",
+        "contended",
+        "lost",
+        "overruns",
+        "last_duration",
+        "updated_at",
+    )
+
+    # Los datos se copian de Redis, así que la vista es de solo lectura
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
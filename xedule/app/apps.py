@@ -1,5 +1,8 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 from django.db.models.signals import post_migrate
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_save
 
 
 class AppConfig(AppConfig):
@@ -9,6 +12,26 @@ class AppConfig(AppConfig):
     def ready(self):
         # Importar la función para crear tareas periódicas
         from .signals import create_periodic_tasks
+        from .signals import presign_nostr_event
+        from .signals import remove_note_schedule
+        from .signals import resign_nostr_events
+        from .signals import sync_note_schedule
+        from .signals import unpark_notes
 
         # Conectar la señal post_migrate
         post_migrate.connect(create_periodic_tasks, sender=self)
+
+        # Mantener el temporizador de Redis al día con las notas
+        note_model = self.get_model("Note")
+        post_save.connect(sync_note_schedule, sender=note_model)
+        post_delete.connect(remove_note_schedule, sender=note_model)
+
+        # Firmar los eventos de Nostr al guardar las notas o las credenciales
+        credentials_model = self.get_model("NostrCredentials")
+        pre_save.connect(presign_nostr_event, sender=note_model)
+        post_save.connect(resign_nostr_events, sender=credentials_model)
+        post_delete.connect(resign_nostr_events, sender=credentials_model)
+
+        # Volver a encolar las notas aparcadas al configurar credenciales
+        post_save.connect(unpark_notes, sender=credentials_model)
+        post_save.connect(unpark_notes, sender=self.get_model("TwitterCredentials"))
@@ -0,0 +1,62 @@
+"""Negative cache of credentials rejected by X or the Nostr relays.
+
+Revoked tokens fail every note of the user the same way, so the first
+authentication failure is recorded on the credentials and in the cache, and
+the platform is skipped for the user until the credentials are saved again,
+which changes their ``updated_at``. The database record survives cache
+evictions and is what the credentials forms show; the cache lets workers
+holding credentials loaded before the failure see it without a query.
+"""
+
+import logging
+
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "xedule:credentials:broken"
+CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
+
+def _cache_key(credentials):
+    return f"{CACHE_PREFIX}:{type(credentials).__name__}:{credentials.pk}"
+
+
+def mark_credentials_broken(credentials, error):
+    """Record that the platform rejected the credentials."""
+    now = timezone.now()
+    error = error[:255]
+    # A queryset update keeps updated_at as is; credentials saved in the
+    # meantime are left alone
+    type(credentials).objects.filter(
+        pk=credentials.pk, updated_at=credentials.updated_at
+    ).update(
+        auth_error=error,
+        auth_failed_at=now,
+        auth_failed_version=F("updated_at"),
+    )
+    credentials.auth_error = error
+    credentials.auth_failed_at = now
+    credentials.auth_failed_version = credentials.updated_at
+    cache.set(_cache_key(credentials), (credentials.updated_at, error), CACHE_TIMEOUT)
+    logger.warning(
+        "%s of user %s rejected: %s",
+        type(credentials).__name__,
+        credentials.user_id,
+        error,
+    )
+
+
+def get_credentials_error(credentials):
+    """Return why the credentials were rejected, or None if they work.
+
+    Credentials saved since they were rejected are tried again.
+    """
+    if credentials.is_broken:
+        return credentials.auth_error
+    cached = cache.get(_cache_key(credentials))
+    if cached is not None and cached[0] == credentials.updated_at:
+        return cached[1]
+    return None
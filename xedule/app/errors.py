@@ -0,0 +1,144 @@
+"""Classification of the errors returned by X and the Nostr relays.
+
+Every failed publish gets an error code stored on the note, and each code
+belongs to one of three kinds that decide what happens next:
+
+- RETRYABLE errors, like network failures or 5xx answers, are retried with
+  backoff until MAX_RETRIES.
+- RATE_LIMITED errors defer the note without spending an attempt.
+- PERMANENT errors, like bad credentials, duplicate content or a text X
+  rejects, would fail the same way on every retry, so the note fails at once.
+
+Each platform is judged on its own error: a note is retried while one of the
+platforms it misses may still work, and a note published to one platform
+keeps its partial status when the other one fails for good.
+"""
+
+import tweepy
+
+RETRYABLE = "retryable"
+RATE_LIMITED = "rate_limited"
+PERMANENT = "permanent"
+
+X_BAD_REQUEST = "x_bad_request"
+X_UNAUTHORIZED = "x_unauthorized"
+X_FORBIDDEN = "x_forbidden"
+X_ACCESS_REVOKED = "x_access_revoked"
+X_DUPLICATE = "x_duplicate"
+X_NOT_FOUND = "x_not_found"
+X_RATE_LIMITED = "x_rate_limited"
+X_SERVER_ERROR = "x_server_error"
+X_NETWORK_ERROR = "x_network_error"
+NOSTR_INVALID_KEY = "nostr_invalid_key"
+NOSTR_REJECTED = "nostr_rejected"
+NOSTR_RATE_LIMITED = "nostr_rate_limited"
+NOSTR_UNREACHABLE = "nostr_unreachable"
+
+ERROR_KINDS = {
+    X_BAD_REQUEST: PERMANENT,
+    X_UNAUTHORIZED: PERMANENT,
+    X_FORBIDDEN: PERMANENT,
+    X_ACCESS_REVOKED: PERMANENT,
+    X_DUPLICATE: PERMANENT,
+    X_NOT_FOUND: PERMANENT,
+    X_RATE_LIMITED: RATE_LIMITED,
+    X_SERVER_ERROR: RETRYABLE,
+    X_NETWORK_ERROR: RETRYABLE,
+    NOSTR_INVALID_KEY: PERMANENT,
+    NOSTR_REJECTED: PERMANENT,
+    NOSTR_RATE_LIMITED: RATE_LIMITED,
+    NOSTR_UNREACHABLE: RETRYABLE,
+}
+
+# Codes that end the publishing of a note, even one published to the other
+# platform
+PERMANENT_ERRORS = [code for code, kind in ERROR_KINDS.items() if kind == PERMANENT]
+
+# Codes meaning the platform rejected the credentials themselves. Other 403
+# answers of X refuse one note only.
+AUTH_ERRORS = {X_UNAUTHORIZED, X_ACCESS_REVOKED, NOSTR_INVALID_KEY}
+
+# When a note fails on several platforms, its code is the most severe one
+SEVERITY = {RETRYABLE: 0, RATE_LIMITED: 1, PERMANENT: 2}
+
+TWITTER_ERROR_CODES = [
+    (tweepy.errors.BadRequest, X_BAD_REQUEST),
+    (tweepy.errors.Unauthorized, X_UNAUTHORIZED),
+    (tweepy.errors.Forbidden, X_FORBIDDEN),
+    (tweepy.errors.NotFound, X_NOT_FOUND),
+    (tweepy.errors.TooManyRequests, X_RATE_LIMITED),
+    (tweepy.errors.TwitterServerError, X_SERVER_ERROR),
+]
+
+# Error codes and problem types of the 403 answers of X meaning the account
+# or the app behind the credentials lost access: suspended or locked account,
+# invalid or expired token, app restricted from writing, app without the
+# access level or permissions the endpoint needs
+X_REVOKED_API_CODES = {64, 89, 261, 326}
+X_REVOKED_PROBLEMS = {"client-forbidden", "oauth1-permissions"}
+
+# Prefixes of the machine-readable reasons of NIP-01 OK answers that mean
+# the relay will keep refusing the event
+REJECTED_PREFIXES = ("invalid:", "blocked:", "pow:", "restricted:")
+RATE_LIMITED_PREFIX = "rate-limited:"
+
+
+def error_kind(code):
+    """Return the kind of an error code, RETRYABLE for unknown ones."""
+    return ERROR_KINDS.get(code, RETRYABLE)
+
+
+def most_severe(codes):
+    """Return the most severe of the error codes, "" if there are none."""
+    return max(
+        filter(None, codes), key=lambda code: SEVERITY[error_kind(code)], default=""
+    )
+
+
+def _access_revoked(exc):
+    """Return whether a 403 answer of X is about the credentials themselves."""
+    if X_REVOKED_API_CODES.intersection(exc.api_codes):
+        return True
+    try:
+        problem = exc.response.json().get("type", "")
+    except (ValueError, AttributeError):
+        return False
+    return problem.rsplit("/", 1)[-1] in X_REVOKED_PROBLEMS
+
+
+def classify_twitter_error(exc):
+    """Return the error code of an exception raised by the X client."""
+    if isinstance(exc, tweepy.errors.Forbidden):
+        if "duplicate" in str(exc).lower():
+            return X_DUPLICATE
+        if _access_revoked(exc):
+            return X_ACCESS_REVOKED
+    for error_class, code in TWITTER_ERROR_CODES:
+        if isinstance(exc, error_class):
+            return code
+    # Connection errors and other unexpected failures may go away by themselves
+    return X_NETWORK_ERROR
+
+
+def classify_relay_results(relay_results):
+    """Return the error code of an event none of its relays accepted enough.
+
+    `relay_results` maps relay URLs to their RelayResult for the event. The
+    event is rejected only if every relay that answered refused it for good;
+    timeouts and connection errors may go away on a retry.
+    """
+    messages = [
+        result.message.lower()
+        for result in relay_results.values()
+        if not result.accepted
+    ]
+    if any(message.startswith(RATE_LIMITED_PREFIX) for message in messages):
+        return NOSTR_RATE_LIMITED
+    if messages and all(message.startswith(REJECTED_PREFIXES) for message in messages):
+        return NOSTR_REJECTED
+    return NOSTR_UNREACHABLE
+
+
+def record_error(note, code):
+    """Set the error code of the note unless it has a more severe one."""
+    note.error_code = most_severe([note.error_code, code])
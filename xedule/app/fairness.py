@@ -0,0 +1,126 @@
+"""Fair share of the publisher between users.
+
+A user who schedules thousands of notes for the same minute must not hold
+back everybody else's notes. Each user may have at most
+PUBLISH_USER_INFLIGHT notes times their weight claimed at once, and a run
+publishes its notes in rounds, taking as many notes of each user per round
+as the user's weight. Weights come from PUBLISH_PLAN_WEIGHTS, which maps the
+names of user groups (plans) to weights; everybody else weighs 1.
+"""
+
+from django.conf import settings
+from django.db.models import Case
+from django.db.models import Count
+from django.db.models import ExpressionWrapper
+from django.db.models import F
+from django.db.models import IntegerField
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models import When
+from django.db.models import Window
+from django.db.models.functions import Coalesce
+from django.db.models.functions import RowNumber
+
+from xedule.users.models import User
+
+from .models import Note
+
+
+def user_weights(user_ids):
+    """Return the weights of the given users that are not 1.
+
+    `user_ids` may be a list or a queryset of user IDs.
+    """
+    plan_weights = settings.PUBLISH_PLAN_WEIGHTS
+    if not plan_weights:
+        return {}
+
+    weights: dict[int, int] = {}
+    memberships = User.groups.through.objects.filter(
+        user_id__in=user_ids, group__name__in=plan_weights
+    ).values_list("user_id", "group__name")
+    for user_id, plan in memberships:
+        weights[user_id] = max(weights.get(user_id, 1), plan_weights[plan])
+    return weights
+
+
+def _outer_user_weight():
+    """Return the weight of the user of each row of the outer query."""
+    plan_weights = settings.PUBLISH_PLAN_WEIGHTS
+    if not plan_weights:
+        return Value(1)
+
+    plan_weight = Case(
+        *[
+            When(group__name=plan, then=Value(weight))
+            for plan, weight in plan_weights.items()
+        ],
+        output_field=IntegerField(),
+    )
+    heaviest = (
+        User.groups.through.objects.filter(
+            user_id=OuterRef("user_id"), group__name__in=plan_weights
+        )
+        .order_by(plan_weight.desc())
+        .values(weight=plan_weight)[:1]
+    )
+    return Coalesce(Subquery(heaviest), Value(1))
+
+
+def _rank_by_user(notes):
+    """Number the notes of each user from their earliest scheduled one."""
+    return notes.annotate(
+        rank=Window(
+            RowNumber(),
+            partition_by=F("user_id"),
+            order_by=[F("scheduled_time").asc(), F("id").asc()],
+        )
+    )
+
+
+def fair_share(pending_notes, now):
+    """Return a subquery of the IDs of the pending notes within their caps.
+
+    Every note is ranked among the pending notes of its user, from the
+    earliest scheduled one, and kept if its rank fits in the user's cap.
+    Notes claimed by running publish tasks count against the cap of their
+    user, so overlapping runs do not add up to more than the cap.
+    """
+    in_flight = (
+        Note.objects.filter(user_id=OuterRef("user_id"), claim_expires_at__gt=now)
+        .exclude(claimed_by="")
+        .order_by()
+        .values("user_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    allowance = ExpressionWrapper(
+        settings.PUBLISH_USER_INFLIGHT * _outer_user_weight()
+        - Coalesce(Subquery(in_flight), Value(0)),
+        output_field=IntegerField(),
+    )
+    return (
+        _rank_by_user(pending_notes)
+        .annotate(allowance=allowance)
+        .filter(rank__lte=F("allowance"))
+        .order_by()
+        .values("id")
+    )
+
+
+def round_robin(notes):
+    """Order the notes in rounds that take `weight` notes of every user.
+
+    Heavier users go first within a round, and the notes of a user stay
+    together, so consecutive notes of the same user can be grouped.
+    """
+    return (
+        _rank_by_user(notes.annotate(user_weight=_outer_user_weight()))
+        .annotate(
+            publish_round=ExpressionWrapper(
+                (F("rank") - 1) / F("user_weight"), output_field=IntegerField()
+            )
+        )
+        .order_by("publish_round", "-user_weight", "user_id", "scheduled_time", "id")
+    )
@@ -1,8 +1,12 @@
 from django import forms
 
+from .keys import InvalidKeyError
+from .keys import parse_private_key
 from .models import NostrCredentials
 from .models import Note
 from .models import TwitterCredentials
+from .relay_urls import merge_relay_urls
+from .relay_urls import normalize_relay_url
 
 
 class TweetForm(forms.ModelForm):
@@ -66,3 +70,38 @@ class NostrCredentialsForm(forms.ModelForm):
             "public_key": "Your Nostr public key in npub format",
             "relay_urls": "Enter one relay URL per line, starting with wss://",
         }
+
+    def clean_relay_urls(self):
+        relay_urls = self.cleaned_data["relay_urls"].splitlines()
+        errors = []
+        for url in relay_urls:
+            if not url.strip():
+                continue
+            try:
+                normalize_relay_url(url)
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            raise forms.ValidationError(errors)
+        return "\n".join(merge_relay_urls(relay_urls))
+
+    def clean_private_key(self):
+        private_key = self.cleaned_data["private_key"].strip()
+        try:
+            parse_private_key(private_key)
+        except InvalidKeyError as e:
+            raise forms.ValidationError(str(e)) from e
+        return private_key
+
+    def clean(self):
+        super().clean()
+        cleaned_data = self.cleaned_data
+        private_key = cleaned_data.get("private_key")
+        public_key = cleaned_data.get("public_key", "").strip()
+        if private_key and public_key:
+            expected = parse_private_key(private_key).public_key.bech32()
+            if public_key != expected:
+                self.add_error(
+                    "public_key", "The public key does not match the private key."
+                )
+        return cleaned_data
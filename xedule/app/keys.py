@@ -0,0 +1,92 @@
+"""Parsed Nostr private keys reused across the notes of a worker.
+
+Decoding an nsec and deriving its public key is repeated for every note of a
+user otherwise. Parsed keys are cached here per credentials and tied to
+their ``updated_at``, so edited credentials are parsed again. Entries expire
+after KEY_CACHE_TTL to keep secrets in memory no longer than needed.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import nostr.key as nk
+from nostr import bech32
+
+KEY_CACHE_SIZE = 256
+KEY_CACHE_TTL = 10 * 60  # seconds
+
+_keys: OrderedDict[int, "CachedKey"] = OrderedDict()
+_keys_lock = threading.Lock()
+
+
+class InvalidKeyError(ValueError):
+    """The text is not a valid nsec private key."""
+
+
+class CachedKey(NamedTuple):
+    updated_at: object
+    expires_at: float
+    private_key: nk.PrivateKey
+
+
+def parse_private_key(nsec):
+    """Decode an nsec private key, raising InvalidKeyError if it is not one."""
+    hrp, data, _ = bech32.bech32_decode(nsec.strip())
+    if hrp != "nsec" or data is None:
+        msg = "Enter a private key in nsec format."
+        raise InvalidKeyError(msg)
+
+    try:
+        return nk.PrivateKey(bytes(bech32.convertbits(data, 5, 8)[:-1]))
+    except Exception as e:
+        msg = "The private key is not valid."
+        raise InvalidKeyError(msg) from e
+
+
+def get_private_key(credentials):
+    """Return the parsed key of the Nostr credentials, parsing it if needed."""
+    now = time.monotonic()
+    with _keys_lock:
+        cached = _keys.get(credentials.pk)
+        if (
+            cached is not None
+            and cached.updated_at == credentials.updated_at
+            and cached.expires_at > now
+        ):
+            _keys.move_to_end(credentials.pk)
+            return cached.private_key
+
+        private_key = parse_private_key(credentials.private_key)
+        _keys[credentials.pk] = CachedKey(
+            updated_at=credentials.updated_at,
+            expires_at=now + KEY_CACHE_TTL,
+            private_key=private_key,
+        )
+        _keys.move_to_end(credentials.pk)
+        while len(_keys) > KEY_CACHE_SIZE:
+            _keys.popitem(last=False)
+        _evict_expired(now)
+        return private_key
+
+
+def forget_private_key(credentials_pk):
+    """Drop the cached key of the given credentials."""
+    with _keys_lock:
+        _keys.pop(credentials_pk, None)
+
+
+def clear_private_keys():
+    """Drop every cached key.
+
+    Python offers no way to wipe the immutable bytes of a key, so this only
+    drops the references to them.
+    """
+    with _keys_lock:
+        _keys.clear()
+
+
+def _evict_expired(now):
+    for pk in [pk for pk, cached in _keys.items() if cached.expires_at <= now]:
+        del _keys[pk]
@@ -0,0 +1,119 @@
+"""Priority lanes of the due notes, by how late they are.
+
+After an outage the notes that just became due must not queue behind hours
+of backlog. Due notes are split in three lanes by the time since their
+scheduled time, and each lane is published by tasks on its own Celery queue:
+
+- ON_TIME notes, due for less than PUBLISH_LATE_AFTER seconds.
+- LATE notes, due for less than PUBLISH_BACKLOG_AFTER seconds.
+- BACKLOG notes, due for longer. Their tasks take their claims from a token
+  bucket in Redis refilled with PUBLISH_BACKLOG_BUDGET notes per minute, so
+  the backlog drains at a steady pace however many tasks run, without
+  crowding out the other lanes.
+
+The on-time queue can then be served by dedicated workers.
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+ON_TIME = "on_time"
+LATE = "late"
+BACKLOG = "backlog"
+
+# In order of priority
+LANES = [ON_TIME, LATE, BACKLOG]
+LANE_QUEUES = {
+    ON_TIME: "publish_on_time",
+    LATE: "publish_late",
+    BACKLOG: "publish_backlog",
+}
+
+BACKLOG_BUDGET_KEY = "xedule:lanes:backlog:budget"
+BACKLOG_BUDGET_PERIOD = 60  # seconds
+
+# Refill the bucket in KEYS[1], holding up to ARGV[2] tokens and refilled with
+# ARGV[3] per second, then take up to ARGV[4] whole tokens from it. ARGV[1] is
+# the current time. Returns the number of tokens taken.
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local taken = math.max(0, math.min(math.floor(tokens), tonumber(ARGV[4])))
+redis.call("HSET", KEYS[1], "tokens", tokens - taken, "updated", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate))
+return taken
+"""
+
+
+def lane_filter(lane, now=None):
+    """Return the condition on the due notes that belong to a lane."""
+    now = now or timezone.now()
+    late_since = now - timedelta(seconds=settings.PUBLISH_LATE_AFTER)
+    backlog_since = now - timedelta(seconds=settings.PUBLISH_BACKLOG_AFTER)
+    if lane == ON_TIME:
+        return Q(scheduled_time__gt=late_since)
+    if lane == LATE:
+        return Q(scheduled_time__gt=backlog_since, scheduled_time__lte=late_since)
+    return Q(scheduled_time__lte=backlog_since)
+
+
+def split_by_lane(pending_notes):
+    """Return (lane, notes) pairs for the lanes with due notes, by priority."""
+    now = timezone.now()
+    lanes = []
+    for lane in LANES:
+        notes = pending_notes.filter(lane_filter(lane, now))
+        if notes.exists():
+            lanes.append((lane, notes))
+    return lanes
+
+
+def claim_limit(lane):
+    """Return how many notes a publish task of the lane may claim now.
+
+    Backlog tasks take the limit from the backlog budget; give back what
+    they do not claim with refund_claim_limit.
+    """
+    if lane != BACKLOG:
+        return settings.PUBLISH_CLAIM_BATCH_SIZE
+
+    budget = settings.PUBLISH_BACKLOG_BUDGET
+    wanted = min(settings.PUBLISH_CLAIM_BATCH_SIZE, budget)
+    try:
+        return get_redis().eval(
+            TAKE_SCRIPT,
+            1,
+            BACKLOG_BUDGET_KEY,
+            time.time(),
+            budget,
+            budget / BACKLOG_BUDGET_PERIOD,
+            wanted,
+        )
+    except redis.RedisError:
+        logger.warning("Could not take from the backlog budget, taking %s", wanted)
+        return wanted
+
+
+def refund_claim_limit(lane, unused):
+    """Give back the part of the limit of a lane a task did not claim."""
+    if lane != BACKLOG or unused <= 0:
+        return
+    try:
+        get_redis().hincrbyfloat(BACKLOG_BUDGET_KEY, "tokens", unused)
+    except redis.RedisError:
+        logger.warning("Could not refund the backlog budget")
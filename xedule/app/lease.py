@@ -0,0 +1,173 @@
+"""Leases in Redis that keep overlapping publish runs from piling up.
+
+A run takes the lease with a short TTL and a heartbeat thread renews it while
+the run goes on, so a worker that dies frees it within seconds while a slow
+run keeps it as long as it needs. Every lease keeps contention counters next
+to it (acquired, contended, lost and overrun runs, plus the duration of the
+last run) so runs outgrowing their interval show up; read them with
+get_lease_stats.
+
+Like the rate limiter, leases fail open when Redis is unavailable: the notes
+claimed by each run keep overlapping runs from publishing the same note.
+"""
+
+import logging
+import threading
+import time
+import uuid
+
+import redis
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "xedule:lease"
+
+# Extend the lease in KEYS[1] to ARGV[2] milliseconds if ARGV[1] still holds it
+RENEW_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Delete the lease in KEYS[1] if ARGV[1] still holds it
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def _lease_key(name):
+    return f"{KEY_PREFIX}:{name}"
+
+
+def _stats_key(name):
+    return f"{KEY_PREFIX}:{name}:stats"
+
+
+class Lease:
+    """Lease on `name` for the duration of a ``with`` block.
+
+    The lease expires `ttl` seconds after its last renewal; the heartbeat
+    renews it every third of that. A run holding it for longer than
+    `interval` seconds counts as an overrun. Check ``acquired`` inside the
+    block to know whether another holder had it.
+    """
+
+    def __init__(self, name, ttl, interval=None):
+        self.name = name
+        self.ttl = ttl
+        self.interval = interval
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+        self.lost = False
+        self._started = None
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self):
+        """Try to take the lease and start its heartbeat."""
+        try:
+            client = get_redis()
+            self.acquired = bool(
+                client.set(
+                    _lease_key(self.name), self.token, nx=True, px=self._ttl_ms()
+                )
+            )
+            client.hincrby(
+                _stats_key(self.name), "acquired" if self.acquired else "contended"
+            )
+        except redis.RedisError:
+            logger.warning("Could not take the %s lease, running without it", self.name)
+            self.acquired = True
+            return self.acquired
+
+        if self.acquired:
+            self._started = time.monotonic()
+            self._heartbeat = threading.Thread(
+                target=self._renew_until_released, daemon=True
+            )
+            self._heartbeat.start()
+        else:
+            logger.info("The %s lease is held by another run", self.name)
+        return self.acquired
+
+    def release(self):
+        """Stop the heartbeat and free the lease if it is still ours."""
+        if self._started is None:
+            return
+        self._stop_heartbeat()
+        duration = time.monotonic() - self._started
+        self._started = None
+        try:
+            client = get_redis()
+            client.eval(RELEASE_SCRIPT, 1, _lease_key(self.name), self.token)
+            client.hset(_stats_key(self.name), "last_duration", duration)
+            if self.interval is not None and duration > self.interval:
+                client.hincrby(_stats_key(self.name), "overruns")
+                logger.warning(
+                    "The %s run took %.1f seconds, longer than its %s second interval",
+                    self.name,
+                    duration,
+                    self.interval,
+                )
+        except redis.RedisError:
+            logger.warning("Could not release the %s lease", self.name)
+
+    def _stop_heartbeat(self):
+        if self._heartbeat is None:
+            return
+        self._stop.set()
+        self._heartbeat.join()
+        self._heartbeat = None
+
+    def _renew_until_released(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                client = get_redis()
+                renewed = client.eval(
+                    RENEW_SCRIPT, 1, _lease_key(self.name), self.token, self._ttl_ms()
+                )
+                if not renewed:
+                    client.hincrby(_stats_key(self.name), "lost")
+            except redis.RedisError:
+                logger.warning("Could not renew the %s lease", self.name)
+                continue
+            if not renewed:
+                # It expired before the heartbeat came, and may be held by
+                # another run now
+                self.lost = True
+                logger.error("Lost the %s lease", self.name)
+                return
+
+    def _ttl_ms(self):
+        return int(self.ttl * 1000)
+
+
+def lease_contended(name):
+    """Return whether a run holds the lease, counting the contention if so."""
+    try:
+        client = get_redis()
+        if not client.exists(_lease_key(name)):
+            return False
+        client.hincrby(_stats_key(name), "contended")
+    except redis.RedisError:
+        return False
+    return True
+
+
+def get_lease_stats(name):
+    """Return the contention counters of a lease."""
+    stats = get_redis().hgetall(_stats_key(name))
+    return {field.decode(): float(value) for field, value in stats.items()}
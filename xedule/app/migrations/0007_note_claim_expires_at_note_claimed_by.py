@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_alter_nostrcredentials_relay_urls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='claim_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Claim expires at'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='claimed_by',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Claimed by'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_note_claim_expires_at_note_claimed_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Failed attempts'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Next attempt at'),
+        ),
+        migrations.AlterField(
+            model_name='note',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('published_x', 'Published in X'), ('published_n', 'Published in Nostr'), ('published', 'Published'), ('error', 'Error')], default='pending', max_length=12, verbose_name='State'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:13
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # The index is built without locking writes on app_note
+    atomic = False
+
+    dependencies = [
+        ('app', '0008_note_attempts_note_next_attempt_at_alter_note_status'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='note',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'published_x', 'published_n'])), fields=['scheduled_time', 'user'], name='note_due_idx'),
+        ),
+    ]
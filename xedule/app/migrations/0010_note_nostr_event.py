@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_note_due_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='nostr_event',
+            field=models.JSONField(blank=True, null=True, verbose_name='Signed Nostr event'),
+        ),
+    ]
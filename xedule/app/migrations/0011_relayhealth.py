@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_note_nostr_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelayHealth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=255, unique=True, verbose_name='URL')),
+                ('connect_latency', models.FloatField(blank=True, null=True, verbose_name='Connect latency (s)')),
+                ('ack_latency', models.FloatField(blank=True, null=True, verbose_name='Ack latency (s)')),
+                ('failure_rate', models.FloatField(blank=True, null=True, verbose_name='Failure rate')),
+                ('accepted', models.PositiveIntegerField(default=0, verbose_name='Accepted events')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Failed events')),
+                ('consecutive_failures', models.PositiveIntegerField(default=0, verbose_name='Consecutive failed deliveries')),
+                ('circuit_open_until', models.DateTimeField(blank=True, null=True, verbose_name='Circuit open until')),
+                ('last_delivery_at', models.DateTimeField(blank=True, null=True, verbose_name='Last delivery')),
+            ],
+            options={
+                'verbose_name': 'Relay health',
+                'verbose_name_plural': 'Relay health',
+                'ordering': ['url'],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:27
+
+from urllib.parse import urlsplit, urlunsplit
+
+from django.db import migrations, models
+
+DEFAULT_PORTS = {"ws": 80, "wss": 443}
+
+
+def normalize_relay_url(url):
+    # Copy of xedule.app.relay_urls.normalize_relay_url as of this migration
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        msg = f"{url} is not a ws:// or wss:// URL"
+        raise ValueError(msg)
+    netloc = parts.hostname
+    if parts.port is not None and parts.port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{parts.port}"
+    return urlunsplit((scheme, netloc, parts.path.rstrip("/"), parts.query, ""))
+
+
+def fill_relays(apps, schema_editor):
+    NostrCredentials = apps.get_model("app", "NostrCredentials")
+    credentials = list(NostrCredentials.objects.all())
+    for item in credentials:
+        relays = {}
+        for url in item.relay_urls.splitlines():
+            if not url.strip():
+                continue
+            try:
+                relays.setdefault(normalize_relay_url(url))
+            except ValueError:
+                pass
+        item.relays = list(relays)
+    NostrCredentials.objects.bulk_update(credentials, ["relays"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_relayhealth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nostrcredentials',
+            name='relays',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Relays'),
+        ),
+        migrations.RunPython(fill_relays, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_nostrcredentials_relays'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='note',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('published_x', 'Published in X'), ('published_n', 'Published in Nostr'), ('published', 'Published'), ('error', 'Error'), ('parked', 'Waiting for credentials')], default='pending', max_length=12, verbose_name='State'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_alter_note_status_parked'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='error_code',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Error code'),
+        ),
+    ]
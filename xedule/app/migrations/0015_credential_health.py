@@ -0,0 +1,43 @@
+# Generated by Django 4.2.20 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_note_error_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nostrcredentials',
+            name='auth_error',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Authentication error'),
+        ),
+        migrations.AddField(
+            model_name='nostrcredentials',
+            name='auth_failed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Authentication failed at'),
+        ),
+        migrations.AddField(
+            model_name='nostrcredentials',
+            name='auth_failed_version',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='twittercredentials',
+            name='auth_error',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Authentication error'),
+        ),
+        migrations.AddField(
+            model_name='twittercredentials',
+            name='auth_failed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Authentication failed at'),
+        ),
+        migrations.AddField(
+            model_name='twittercredentials',
+            name='auth_failed_version',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
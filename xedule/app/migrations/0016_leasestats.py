@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_credential_health'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaseStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='Name')),
+                ('acquired', models.PositiveIntegerField(default=0, verbose_name='Acquired runs')),
+                ('contended', models.PositiveIntegerField(default=0, verbose_name='Contended runs')),
+                ('lost', models.PositiveIntegerField(default=0, verbose_name='Lost leases')),
+                ('overruns', models.PositiveIntegerField(default=0, verbose_name='Overruns')),
+                ('last_duration', models.FloatField(blank=True, null=True, verbose_name='Last run duration (s)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Lease stats',
+                'verbose_name_plural': 'Lease stats',
+                'ordering': ['name'],
+            },
+        ),
+    ]
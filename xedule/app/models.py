@@ -2,6 +2,11 @@ from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from .relay_urls import merge_relay_urls
+
+# Statuses of the notes the publisher still has to deliver somewhere
+UNFINISHED_STATUSES = ["pending", "published_x", "published_n"]
+
 
 class Note(models.Model):
     STATUS_CHOICES = (
@@ -9,6 +14,8 @@ class Note(models.Model):
         ("published_x", "Published in X"),
         ("published_n", "Published in Nostr"),
         ("published", "Published"),
+        ("error", "Error"),
+        ("parked", "Waiting for credentials"),
     )
 
     user = models.ForeignKey(
@@ -61,17 +68,93 @@ class Note(models.Model):
         verbose_name="Nostr ID",
     )
     last_error = models.TextField(blank=True, default="", verbose_name="Last error")
+    # Code of the last failure, classified by xedule.app.errors
+    error_code = models.CharField(
+        max_length=32,
+        blank=True,
+        default="",
+        verbose_name="Error code",
+    )
+    # Nostr event signed ahead of the publish time, as sent to the relays
+    nostr_event = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name="Signed Nostr event",
+    )
+    # Lease taken by the publish task currently working on the note
+    claimed_by = models.CharField(
+        max_length=32,
+        blank=True,
+        default="",
+        verbose_name="Claimed by",
+    )
+    claim_expires_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Claim expires at",
+    )
+    # Failed publish attempts, retried with backoff until MAX_RETRIES
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Failed attempts",
+    )
+    next_attempt_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Next attempt at",
+    )
 
     class Meta:
         ordering = ["-created_at"]
         verbose_name = "Note"
         verbose_name_plural = "Tweets"
+        indexes = [
+            # Due-notes query of the publisher, which only looks at the small
+            # set of unfinished notes among the whole history
+            models.Index(
+                fields=["scheduled_time", "user"],
+                condition=models.Q(status__in=UNFINISHED_STATUSES),
+                name="note_due_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.content[:30]}... ({self.status})"
 
 
-class TwitterCredentials(models.Model):
+class CredentialHealth(models.Model):
+    """Record of the last time X or the relays rejected the credentials.
+
+    It is written with a queryset update, which leaves ``updated_at`` alone,
+    so the credentials count as broken until the user saves them again.
+    """
+
+    auth_error = models.CharField(
+        _("Authentication error"),
+        max_length=255,
+        blank=True,
+        default="",
+        editable=False,
+    )
+    auth_failed_at = models.DateTimeField(
+        _("Authentication failed at"), blank=True, null=True, editable=False
+    )
+    # updated_at of the credentials that were rejected
+    auth_failed_version = models.DateTimeField(blank=True, null=True, editable=False)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def is_broken(self):
+        return (
+            self.auth_failed_version is not None
+            and self.auth_failed_version == self.updated_at
+        )
+
+
+class TwitterCredentials(CredentialHealth):
     user = models.OneToOneField(
         "users.User",
         on_delete=models.CASCADE,
@@ -83,7 +166,6 @@ class TwitterCredentials(models.Model):
     access_token = models.CharField(_("Access Token"), max_length=255)
     access_token_secret = models.CharField(_("Access Token Secret"), max_length=255)
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
-    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
     class Meta:
         verbose_name = _("Twitter Credentials")
@@ -92,8 +174,19 @@ class TwitterCredentials(models.Model):
     def __str__(self):
         return f"Twitter credentials for {self.user.username}"
 
+    @property
+    def is_configured(self):
+        return all(
+            [
+                self.api_key,
+                self.api_secret_key,
+                self.access_token,
+                self.access_token_secret,
+            ]
+        )
 
-class NostrCredentials(models.Model):
+
+class NostrCredentials(CredentialHealth):
     user = models.OneToOneField(
         "users.User",
         on_delete=models.CASCADE,
@@ -108,8 +201,14 @@ class NostrCredentials(models.Model):
         verbose_name=_("Relay URLs"),
         help_text=_("Enter one relay URL per line"),
     )
+    # Normalized relay_urls, set on save
+    relays = models.JSONField(
+        _("Relays"),
+        blank=True,
+        default=list,
+        editable=False,
+    )
     created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
-    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
     class Meta:
         verbose_name = _("Nostr Credentials")
@@ -118,8 +217,63 @@ class NostrCredentials(models.Model):
     def __str__(self):
         return f"Nostr credentials for {self.user.username}"
 
+    def save(self, *args, **kwargs):
+        self.relays = merge_relay_urls(self.relay_urls.splitlines())
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "relay_urls" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "relays"}
+        super().save(*args, **kwargs)
+
+    @property
+    def is_configured(self):
+        return bool(self.private_key)
+
     def get_relay_list(self):
-        """Convert the stored relay_urls text to a list of URLs"""
-        if not self.relay_urls:
-            return []
-        return [url.strip() for url in self.relay_urls.split("\n") if url.strip()]
+        """Return the relays to publish to, including the default ones"""
+        return merge_relay_urls(self.relays, settings.NOSTR_DEFAULT_RELAYS)
+
+
+class RelayHealth(models.Model):
+    """Snapshot of the health of a Nostr relay, kept live in Redis."""
+
+    url = models.CharField(_("URL"), max_length=255, unique=True)
+    connect_latency = models.FloatField(_("Connect latency (s)"), blank=True, null=True)
+    ack_latency = models.FloatField(_("Ack latency (s)"), blank=True, null=True)
+    failure_rate = models.FloatField(_("Failure rate"), blank=True, null=True)
+    accepted = models.PositiveIntegerField(_("Accepted events"), default=0)
+    failed = models.PositiveIntegerField(_("Failed events"), default=0)
+    consecutive_failures = models.PositiveIntegerField(
+        _("Consecutive failed deliveries"), default=0
+    )
+    circuit_open_until = models.DateTimeField(
+        _("Circuit open until"), blank=True, null=True
+    )
+    last_delivery_at = models.DateTimeField(_("Last delivery"), blank=True, null=True)
+
+    class Meta:
+        ordering = ["url"]
+        verbose_name = _("Relay health")
+        verbose_name_plural = _("Relay health")
+
+    def __str__(self):
+        return self.url
+
+
+class LeaseStats(models.Model):
+    """Snapshot of the contention counters of a lease, kept live in Redis."""
+
+    name = models.CharField(_("Name"), max_length=64, unique=True)
+    acquired = models.PositiveIntegerField(_("Acquired runs"), default=0)
+    contended = models.PositiveIntegerField(_("Contended runs"), default=0)
+    lost = models.PositiveIntegerField(_("Lost leases"), default=0)
+    overruns = models.PositiveIntegerField(_("Overruns"), default=0)
+    last_duration = models.FloatField(_("Last run duration (s)"), blank=True, null=True)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    class Meta:
+        ordering = ["name"]
+        verbose_name = _("Lease stats")
+        verbose_name_plural = _("Lease stats")
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,117 @@
+"""Nostr events of the notes, signed ahead of their publish time.
+
+The event of a note only depends on its content, its scheduled time and the
+user's key, so it is signed when the note is saved and stored on the note.
+Publishing then only has to send it. A stored event is trusted as long as
+its ID still matches the note: editing the note changes the ID, and changing
+the credentials clears the events of the user's notes.
+"""
+
+import logging
+
+from nostr.event import Event
+
+from .keys import get_private_key
+from .models import UNFINISHED_STATUSES
+from .models import NostrCredentials
+
+logger = logging.getLogger(__name__)
+
+
+def build_nostr_event(note, private_key):
+    """Build and sign the Nostr event of a note.
+
+    The timestamp comes from the scheduled time, so the event ID stays the
+    same across retries and relays recognise a resend as the same event.
+    """
+    event = Event(
+        content=note.content,
+        public_key=private_key.public_key.hex(),
+        kind=1,  # Regular note
+        tags=[],  # No tags for simple notes
+        created_at=_created_at(note),  # Timestamp consistente
+    )
+
+    # Firmar el evento para finalizar su ID
+    private_key.sign_event(event)
+    return event
+
+
+def _created_at(note):
+    timestamp = note.scheduled_time or note.created_at
+    return int(timestamp.timestamp())
+
+
+def event_to_dict(event):
+    """Serialize an event the way it is sent to the relays."""
+    return {
+        "id": event.id,
+        "pubkey": event.public_key,
+        "created_at": event.created_at,
+        "kind": event.kind,
+        "tags": event.tags,
+        "content": event.content,
+        "sig": event.signature,
+    }
+
+
+def event_from_dict(data):
+    """Rebuild an event stored with event_to_dict."""
+    return Event(
+        public_key=data["pubkey"],
+        content=data["content"],
+        created_at=data["created_at"],
+        kind=data["kind"],
+        tags=data["tags"],
+        id=data["id"],
+        signature=data["sig"],
+    )
+
+
+def needs_nostr_event(note):
+    """Return whether the note still has to be published to Nostr."""
+    return (
+        note.publish_to_nostr
+        and not note.nostr_id
+        and note.status in UNFINISHED_STATUSES
+    )
+
+
+def get_signed_event(note):
+    """Return the stored event of the note if it still matches the note."""
+    data = note.nostr_event
+    if not data:
+        return None
+
+    expected_id = Event.compute_id(
+        data["pubkey"], _created_at(note), data["kind"], data["tags"], note.content
+    )
+    if data["id"] != expected_id:
+        return None
+    return event_from_dict(data)
+
+
+def presign_note(note):
+    """Sign the event of a note about to be saved, unless it is up to date.
+
+    Notes that cannot be signed now, like those of users without Nostr
+    credentials yet, are signed when they are published.
+    """
+    if not needs_nostr_event(note):
+        note.nostr_event = None
+        return
+    if note.scheduled_time is None:
+        # Unscheduled notes are never published
+        return
+    if get_signed_event(note) is not None:
+        return
+
+    note.nostr_event = None
+    try:
+        credentials = NostrCredentials.objects.filter(user_id=note.user_id).first()
+        if credentials is None or not credentials.private_key:
+            return
+        private_key = get_private_key(credentials)
+        note.nostr_event = event_to_dict(build_nostr_event(note, private_key))
+    except Exception:
+        logger.exception("Could not sign the Nostr event of note %s", note.pk)
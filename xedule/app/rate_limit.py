@@ -0,0 +1,138 @@
+"""Token buckets in Redis metering the posts sent to the X API.
+
+Every ``create_tweet`` call takes a token from the bucket of the user's
+credentials and from the bucket of the app they belong to. The buckets start
+from the X_RATE_LIMITS settings and are corrected from the ``x-rate-limit-*``
+and ``x-app-limit-24hour-*`` headers X sends back, so a note is deferred until
+its buckets refill instead of spending its retries on 429 answers.
+"""
+
+import hashlib
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "xedule:ratelimit:x"
+# Header prefixes of the user and app limits, in the order of _bucket_keys
+LIMIT_HEADERS = ("x-rate-limit", "x-app-limit-24hour")
+DEFAULT_RETRY_AFTER = 60  # seconds, for 429 answers without reset headers
+
+# Refill every bucket in KEYS, then take one token from all of them, or none
+# if any is empty or blocked. ARGV holds the current time followed by the
+# capacity and refill rate (tokens per second) of each bucket. Returns the
+# seconds to wait before a token is available, "0" when one was taken.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call("HMGET", key, "tokens", "updated", "blocked_until")
+    local available = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    local blocked_until = tonumber(bucket[3]) or 0
+    tokens[i] = math.min(capacity, available + (now - updated) * rate)
+    if blocked_until > now then
+        wait = math.max(wait, blocked_until - now)
+    elseif tokens[i] < 1 then
+        wait = math.max(wait, (1 - tokens[i]) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    redis.call("HSET", key, "tokens", tokens[i] - 1, "updated", now)
+    redis.call("EXPIRE", key, math.ceil(capacity / rate))
+end
+return "0"
+"""
+
+
+class RateLimitedError(Exception):
+    """The X API cannot take another post before `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited for {retry_after:.0f} seconds")
+
+
+def _bucket_key(scope, secret):
+    """Name the bucket of a token without storing the token itself."""
+    digest = hashlib.sha256(secret.encode()).hexdigest()[:16]
+    return f"{KEY_PREFIX}:{scope}:{digest}"
+
+
+def _bucket_keys(client):
+    """Return the user and app bucket keys of a tweepy client."""
+    return {
+        "user": _bucket_key("user", client.access_token),
+        "app": _bucket_key("app", client.consumer_key),
+    }
+
+
+def acquire(client):
+    """Take a token for one post with the given client.
+
+    Raises RateLimitedError with the time to wait when a bucket is empty.
+    When Redis is unavailable the call is let through, since X still enforces
+    its own limits.
+    """
+    keys = _bucket_keys(client)
+    args = [time.time()]
+    for scope in keys:
+        capacity, period = settings.X_RATE_LIMITS[scope]
+        args.extend([capacity, capacity / period])
+
+    try:
+        wait = float(get_redis().eval(ACQUIRE_SCRIPT, len(keys), *keys.values(), *args))
+    except redis.RedisError:
+        logger.warning("Could not check the X rate limit, letting the call through")
+        return
+
+    if wait > 0:
+        raise RateLimitedError(wait)
+
+
+def record_response(client, headers):
+    """Correct the buckets of a client from the rate limit headers of X."""
+    keys = _bucket_keys(client).values()
+    limits = {
+        key: (headers.get(f"{prefix}-remaining"), headers.get(f"{prefix}-reset"))
+        for key, prefix in zip(keys, LIMIT_HEADERS, strict=True)
+    }
+
+    now = time.time()
+    try:
+        pipeline = get_redis().pipeline()
+        for key, (remaining, reset) in limits.items():
+            if remaining is None or reset is None:
+                continue
+            pipeline.hset(key, mapping={"tokens": int(remaining), "updated": now})
+            if int(remaining) == 0:
+                # The bucket stays empty until X resets the window
+                pipeline.hset(key, "blocked_until", int(reset))
+        pipeline.execute()
+    except redis.RedisError:
+        logger.warning("Could not record the X rate limit headers")
+
+
+def retry_after(headers):
+    """Return the seconds until X accepts posts again after a 429 answer."""
+    resets = [
+        int(headers[f"{prefix}-reset"])
+        for prefix in LIMIT_HEADERS
+        if headers.get(f"{prefix}-remaining") == "0" and f"{prefix}-reset" in headers
+    ]
+    if not resets:
+        return DEFAULT_RETRY_AFTER
+    return max(max(resets) - time.time(), 0) + 1
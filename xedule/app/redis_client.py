@@ -0,0 +1,17 @@
+"""Shared Redis connection for the coordination state of the publisher."""
+
+from functools import cache
+
+import redis
+from django.conf import settings
+
+
+@cache
+def get_redis():
+    """Return the Redis client used for rate limits and other shared state.
+
+    redis-py reopens its pooled connections after a fork, so one client per
+    process is safe with Celery's prefork workers.
+    """
+    options = {"ssl_cert_reqs": "none"} if settings.REDIS_SSL else {}
+    return redis.Redis.from_url(settings.REDIS_URL, **options)
@@ -0,0 +1,166 @@
+"""Health of the Nostr relays, shared by the workers through Redis.
+
+Every delivery updates moving averages of the connect and acknowledgement
+latency and of the failure rate of each relay it used. A relay that fails
+RELAY_CIRCUIT_FAILURES deliveries in a row has its circuit opened and is left
+out of deliveries for RELAY_CIRCUIT_COOLDOWN seconds, after which one more
+delivery decides whether it closes again. Healthy relays are ranked by
+failure rate and then by latency, so the fastest are contacted first.
+"""
+
+import logging
+import time
+from statistics import fmean
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "xedule:relays:health"
+RELAYS_KEY = f"{KEY_PREFIX}:relays"
+SMOOTHING = 0.2  # weight of the latest delivery in the moving averages
+
+# Record the outcome of one delivery to a relay. KEYS are its health hash and
+# the set of known relays; ARGV the relay URL, the current time, the events
+# it accepted and failed, the average ack latency and the connect latency
+# (negative when unknown), the smoothing factor, the failure threshold and
+# the cooldown of the circuit.
+RECORD_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[2])
+local accepted = tonumber(ARGV[3])
+local failed = tonumber(ARGV[4])
+local smoothing = tonumber(ARGV[7])
+local function average(field, value)
+    if value < 0 then
+        return
+    end
+    local current = tonumber(redis.call("HGET", key, field))
+    if current then
+        value = current + smoothing * (value - current)
+    end
+    redis.call("HSET", key, field, tostring(value))
+end
+
+redis.call("SADD", KEYS[2], ARGV[1])
+average("ack_latency", tonumber(ARGV[5]))
+average("connect_latency", tonumber(ARGV[6]))
+average("failure_rate", failed / (accepted + failed))
+redis.call("HINCRBY", key, "accepted", accepted)
+redis.call("HINCRBY", key, "failed", failed)
+redis.call("HSET", key, "updated", tostring(now))
+if accepted > 0 then
+    redis.call("HSET", key, "consecutive_failures", 0)
+    redis.call("HDEL", key, "open_until")
+elseif redis.call("HINCRBY", key, "consecutive_failures", 1) >= tonumber(ARGV[8]) then
+    redis.call("HSET", key, "open_until", tostring(now + tonumber(ARGV[9])))
+end
+"""
+
+FIELDS = [
+    "connect_latency",
+    "ack_latency",
+    "failure_rate",
+    "accepted",
+    "failed",
+    "consecutive_failures",
+    "open_until",
+    "updated",
+]
+
+
+def _health_key(url):
+    return f"{KEY_PREFIX}:{url}"
+
+
+def record_delivery(results, connect_latencies):
+    """Record the answers of the relays to a delivery.
+
+    `results` maps event IDs to the RelayResult of each relay, as returned by
+    RelayPool.deliver, and `connect_latencies` maps relay URLs to the seconds
+    taken by connections opened for it.
+    """
+    outcomes: dict[str, list] = {}
+    for relay_results in results.values():
+        for url, result in relay_results.items():
+            outcomes.setdefault(url, []).append(result)
+
+    try:
+        client = get_redis()
+        for url, relay_results in outcomes.items():
+            latencies = [r.latency for r in relay_results if r.latency is not None]
+            accepted = sum(result.accepted for result in relay_results)
+            client.eval(
+                RECORD_SCRIPT,
+                2,
+                _health_key(url),
+                RELAYS_KEY,
+                url,
+                time.time(),
+                accepted,
+                len(relay_results) - accepted,
+                fmean(latencies) if latencies else -1,
+                connect_latencies.get(url, -1),
+                SMOOTHING,
+                settings.RELAY_CIRCUIT_FAILURES,
+                settings.RELAY_CIRCUIT_COOLDOWN,
+            )
+    except redis.RedisError:
+        logger.warning("Could not record the health of the Nostr relays")
+
+
+def get_relay_health(urls=None):
+    """Return the health of the given relays, or of every known relay.
+
+    The result maps relay URLs to dicts of their numeric health fields, with
+    missing fields set to None.
+    """
+    client = get_redis()
+    if urls is None:
+        urls = sorted(url.decode() for url in client.smembers(RELAYS_KEY))
+    pipeline = client.pipeline()
+    for url in urls:
+        pipeline.hmget(_health_key(url), FIELDS)
+    return {
+        url: {
+            field: float(value) if value is not None else None
+            for field, value in zip(FIELDS, values, strict=True)
+        }
+        for url, values in zip(urls, pipeline.execute(), strict=True)
+    }
+
+
+def is_circuit_open(health, now=None):
+    """Return whether a relay is left out of deliveries for now."""
+    now = now or time.time()
+    return health["open_until"] is not None and health["open_until"] > now
+
+
+def rank_relays(urls):
+    """Order relays from the healthiest to the least healthy.
+
+    Relays with an open circuit are left out, unless that leaves none.
+    Relays without any recorded delivery rank with the healthy ones.
+    """
+    urls = list(urls)
+    try:
+        health = get_relay_health(urls)
+    except redis.RedisError:
+        logger.warning("Could not read the health of the Nostr relays")
+        return urls
+
+    now = time.time()
+    available = [url for url in urls if not is_circuit_open(health[url], now)]
+    if not available:
+        return urls
+    return sorted(
+        available,
+        key=lambda url: (
+            # Relays failing about as often are told apart by their latency
+            round(health[url]["failure_rate"] or 0, 1),
+            health[url]["ack_latency"] or 0,
+        ),
+    )
@@ -0,0 +1,49 @@
+"""Normalization of the relay URLs entered by users.
+
+Kept apart from the relay pool so the models and forms can use it without
+loading the network stack.
+"""
+
+import logging
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {"ws": 80, "wss": 443}
+
+
+def normalize_relay_url(url):
+    """Return the canonical form of a relay URL.
+
+    The scheme and host are lowercased, default ports and trailing slashes
+    dropped, so the same relay written differently maps to a single
+    connection. Raises ValueError if the URL is not a ws:// or wss:// URL.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        msg = f"{url} is not a ws:// or wss:// URL"
+        raise ValueError(msg)
+
+    netloc = parts.hostname
+    if parts.port is not None and parts.port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{parts.port}"
+    return urlunsplit((scheme, netloc, parts.path.rstrip("/"), parts.query, ""))
+
+
+def merge_relay_urls(*url_lists):
+    """Normalize and de-duplicate relay URLs, keeping their first position.
+
+    Invalid URLs are skipped.
+    """
+    relays: dict[str, None] = {}
+    for urls in url_lists:
+        for url in urls:
+            if not url.strip():
+                continue
+            try:
+                relays.setdefault(normalize_relay_url(url))
+            except ValueError:
+                logger.warning("Ignoring invalid relay URL %s", url)
+    return list(relays)
@@ -0,0 +1,397 @@
+"""Long-lived Nostr relay connections shared by the publish tasks of a worker.
+
+Each worker process owns a single :class:`RelayPool`. The pool runs an asyncio
+event loop in a background thread and keeps one websocket per relay URL open
+between tasks, so events go out over warm connections instead of paying a TLS
+handshake and fixed sleeps for every note.
+
+Publishing waits for the NIP-20 ``OK`` answer of every relay, bounded by a
+per-relay timeout, and returns early once a quorum of relays accepted the
+event.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+from collections import Counter
+from functools import partial
+from typing import TYPE_CHECKING
+from typing import NamedTuple
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+from websockets.exceptions import WebSocketException
+from websockets.protocol import State
+
+from .relay_health import record_delivery
+
+if TYPE_CHECKING:
+    from websockets.asyncio.client import ClientConnection
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 5  # seconds
+ACK_TIMEOUT = 5  # seconds to connect, send and receive the OK of one relay
+PING_TIMEOUT = 5  # seconds
+IDLE_TIMEOUT = 5 * 60  # seconds without traffic before a connection is closed
+HEALTH_CHECK_INTERVAL = 30  # seconds
+
+_pools: dict[int, RelayPool] = {}
+_pools_lock = threading.Lock()
+
+
+class RelayResult(NamedTuple):
+    """Answer of a relay to a published event.
+
+    `latency` is the time between sending the event and receiving the answer,
+    in seconds, and is None when the relay did not answer.
+    """
+
+    accepted: bool
+    message: str
+    latency: float | None = None
+
+
+def _ssl_context():
+    """Build the TLS context used for wss:// relays."""
+    context = ssl.create_default_context()
+    # NOTE: This disables ssl certificate verification
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class RelayConnection:
+    """A websocket connection to one relay that reconnects on demand."""
+
+    def __init__(self, url):
+        self.url = url
+        self.websocket: ClientConnection | None = None
+        self.reader = None
+        self.last_used = time.monotonic()
+        # Seconds taken by the last connection, until read by the pool
+        self.connect_latency = None
+        self.lock = asyncio.Lock()
+        # Futures waiting for the OK answer, keyed by event ID
+        self.pending = {}
+
+    @property
+    def is_open(self):
+        return self.websocket is not None and self.websocket.state is State.OPEN
+
+    async def connect(self):
+        """Open the connection unless it is already open, and return it."""
+        if self.is_open:
+            return self.websocket
+
+        await self.close()
+        started = time.monotonic()
+        self.websocket = websocket = await websockets.connect(
+            self.url,
+            ssl=_ssl_context() if self.url.startswith("wss://") else None,
+            open_timeout=CONNECT_TIMEOUT,
+        )
+        self.connect_latency = time.monotonic() - started
+        self.reader = asyncio.create_task(self._read(websocket))
+        logger.info("Connected to relay %s", self.url)
+        return websocket
+
+    async def send(self, message):
+        """Send a message, reconnecting once if the connection was dropped."""
+        async with self.lock:
+            websocket = await self.connect()
+            try:
+                await websocket.send(message)
+            except ConnectionClosed:
+                logger.info("Relay %s closed the connection, reconnecting", self.url)
+                websocket = await self.connect()
+                await websocket.send(message)
+            self.last_used = time.monotonic()
+
+    async def publish(self, messages, ack_timeout):
+        """Send EVENT messages and wait for the relay's OK answer to each.
+
+        `messages` maps event IDs to their EVENT message. Every message goes
+        out over this connection before waiting, and the whole exchange is
+        bounded by `ack_timeout`. Returns a dict mapping each event ID to a
+        :class:`RelayResult`.
+        """
+        loop = asyncio.get_running_loop()
+        futures = {event_id: loop.create_future() for event_id in messages}
+        self.pending.update(futures)
+        sent_at: dict[str, float] = {}
+        answered_at: dict[asyncio.Future, float] = {}
+
+        def mark_answered(future):
+            answered_at.setdefault(future, loop.time())
+
+        for future in futures.values():
+            future.add_done_callback(mark_answered)
+        deadline = loop.time() + ack_timeout
+        try:
+            async with asyncio.timeout_at(deadline):
+                for event_id, message in messages.items():
+                    await self.send(message)
+                    sent_at[event_id] = loop.time()
+                await asyncio.wait(futures.values())
+        except TimeoutError:
+            logger.warning("Relay %s did not answer every event in time", self.url)
+        except (OSError, WebSocketException) as e:
+            logger.warning("Could not send events to relay %s: %s", self.url, e)
+            return {
+                event_id: RelayResult(accepted=False, message=str(e))
+                for event_id in messages
+            }
+        finally:
+            for event_id, future in futures.items():
+                if self.pending.get(event_id) is future:
+                    del self.pending[event_id]
+
+        return {
+            event_id: future.result()._replace(
+                latency=max(answered_at[future] - sent_at.get(event_id, deadline), 0)
+            )
+            if future.done()
+            else RelayResult(accepted=False, message="timeout")
+            for event_id, future in futures.items()
+        }
+
+    async def is_healthy(self):
+        """Return whether the relay answers a ping in time."""
+        websocket = self.websocket
+        if websocket is None or websocket.state is not State.OPEN:
+            return False
+        try:
+            pong_waiter = await websocket.ping()
+            await asyncio.wait_for(pong_waiter, PING_TIMEOUT)
+        except (ConnectionClosed, TimeoutError):
+            return False
+        return True
+
+    async def close(self):
+        """Close the websocket and stop reading from it."""
+        if self.reader is not None:
+            self.reader.cancel()
+            self.reader = None
+        if self.websocket is not None:
+            websocket, self.websocket = self.websocket, None
+            await websocket.close()
+
+    async def _read(self, websocket):
+        """Read relay messages until the connection is closed.
+
+        A message that cannot be handled is logged and skipped, so one bad
+        frame does not leave the connection open with nobody reading it.
+        """
+        try:
+            async for message in websocket:
+                try:
+                    self.handle_message(message)
+                except Exception:
+                    logger.exception(
+                        "Could not handle message from relay %s: %s", self.url, message
+                    )
+        except ConnectionClosed:
+            logger.info("Connection to relay %s closed", self.url)
+
+    def handle_message(self, message):
+        """Resolve the pending publish matching an OK answer of the relay."""
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            logger.warning("Invalid message from relay %s: %s", self.url, message)
+            return
+        if not isinstance(payload, list):
+            logger.warning("Unexpected message from relay %s: %s", self.url, message)
+            return
+
+        if payload[:1] == ["OK"] and len(payload) >= 3:  # noqa: PLR2004
+            if not isinstance(payload[1], str):
+                logger.warning("Invalid OK from relay %s: %s", self.url, message)
+                return
+            future = self.pending.get(payload[1])
+            if future is not None and not future.done():
+                reason = payload[3] if len(payload) > 3 else ""  # noqa: PLR2004
+                future.set_result(
+                    RelayResult(accepted=bool(payload[2]), message=str(reason))
+                )
+        elif payload[:1] == ["NOTICE"]:
+            logger.info("Notice from relay %s: %s", self.url, payload[1:])
+        else:
+            logger.debug("Message from relay %s: %s", self.url, message)
+
+
+class RelayPool:
+    """Relay connections of a worker process, keyed by relay URL."""
+
+    def __init__(self):
+        self.connections = {}
+        # Publishes still waiting for slow relays after a quorum was reached
+        self.background = set()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever,
+            name="nostr-relay-pool",
+            daemon=True,
+        )
+        self.thread.start()
+        self.maintenance = asyncio.run_coroutine_threadsafe(self._maintain(), self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the pool loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def publish(self, relays, events, timeout=ACK_TIMEOUT, quorum=None):
+        """Send the same events to every one of the given relays.
+
+        See :meth:`deliver` for the shape of the result.
+        """
+        return self.deliver(dict.fromkeys(relays, events), timeout, quorum)
+
+    def deliver(self, routes, timeout=ACK_TIMEOUT, quorum=None):
+        """Send events to relays and wait for their answers.
+
+        `routes` maps each relay URL to the events it should receive, so
+        events of many users that share a relay go out over a single session
+        with it. The call returns once every event was accepted by `quorum`
+        of its relays (all of them by default), or once every relay answered
+        or timed out. The result maps each event ID to a dict of
+        :class:`RelayResult` keyed by the relays that answered; relays that
+        are still pending at that point keep receiving the events in the
+        background, and their answers or timeouts are recorded in the relay
+        health once they come.
+        """
+        messages = {
+            url: {event.id: event.to_message() for event in events}
+            for url, events in routes.items()
+        }
+        return self.run(self._deliver(messages, timeout, quorum))
+
+    def pop_connect_latencies(self):
+        """Return the time taken by the connections opened since the last call.
+
+        The result maps relay URLs to seconds.
+        """
+        return self.run(self._pop_connect_latencies())
+
+    def close(self):
+        """Close every connection and stop the pool loop."""
+        self.maintenance.cancel()
+        self.run(self._close_all())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _deliver(self, routes, ack_timeout, quorum):
+        targets = Counter(
+            event_id for messages in routes.values() for event_id in messages
+        )
+        required = {
+            event_id: min(quorum or count, count) for event_id, count in targets.items()
+        }
+        tasks = {
+            asyncio.create_task(self._publish_to(url, messages, ack_timeout)): url
+            for url, messages in routes.items()
+        }
+        results: dict[str, dict[str, RelayResult]] = {
+            event_id: {} for event_id in targets
+        }
+        pending = set(tasks)
+        while pending and not _quorum_reached(results, required):
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                for event_id, result in task.result().items():
+                    results[event_id][tasks[task]] = result
+
+        for task in pending:
+            self.background.add(task)
+            task.add_done_callback(self.background.discard)
+            task.add_done_callback(partial(self._record_late_answers, tasks[task]))
+        return results
+
+    def _record_late_answers(self, url, task):
+        """Record the answers of a relay still pending when the quorum came."""
+        if task.cancelled() or task.exception() is not None:
+            return
+        results = {
+            event_id: {url: result} for event_id, result in task.result().items()
+        }
+        # Recording talks to Redis, which must not block the pool loop
+        self.loop.run_in_executor(None, record_delivery, results, {})
+
+    async def _publish_to(self, url, messages, ack_timeout):
+        connection = self.connections.get(url)
+        if connection is None:
+            connection = self.connections[url] = RelayConnection(url)
+        return await connection.publish(messages, ack_timeout)
+
+    async def _pop_connect_latencies(self):
+        latencies = {}
+        for url, connection in self.connections.items():
+            if connection.connect_latency is not None:
+                latencies[url] = connection.connect_latency
+                connection.connect_latency = None
+        return latencies
+
+    async def _maintain(self):
+        """Periodically evict idle connections and drop unhealthy ones."""
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            try:
+                await self._evict_idle()
+                await self._check_health()
+            except Exception:
+                logger.exception("Error maintaining Nostr relay connections")
+
+    async def _evict_idle(self, now=None):
+        now = now or time.monotonic()
+        for url, connection in list(self.connections.items()):
+            if now - connection.last_used > IDLE_TIMEOUT:
+                del self.connections[url]
+                await connection.close()
+                logger.info("Closed idle connection to relay %s", url)
+
+    async def _check_health(self):
+        for url, connection in list(self.connections.items()):
+            if connection.is_open and not await connection.is_healthy():
+                # The next send reconnects
+                await connection.close()
+                logger.warning("Relay %s failed its health check", url)
+
+    async def _close_all(self):
+        for task in self.background:
+            task.cancel()
+        await asyncio.gather(*self.background, return_exceptions=True)
+        for connection in self.connections.values():
+            await connection.close()
+        self.connections.clear()
+
+
+def _quorum_reached(results, required):
+    """Return whether every event was accepted by its required relay count."""
+    return all(
+        sum(result.accepted for result in relay_results.values()) >= required[event_id]
+        for event_id, relay_results in results.items()
+    )
+
+
+def get_relay_pool():
+    """Return the relay pool of the current process, creating it if needed.
+
+    Pools are keyed by process ID because Celery forks its workers after the
+    parent may already have imported this module.
+    """
+    pid = os.getpid()
+    with _pools_lock:
+        if pid not in _pools:
+            _pools.clear()
+            _pools[pid] = RelayPool()
+        return _pools[pid]
@@ -0,0 +1,155 @@
+"""Redis timer of the notes waiting for their scheduled time.
+
+Unfinished notes are kept in a sorted set scored by the time they are due, so
+the dispatcher can pop exactly the notes whose second came instead of
+scanning the Note table every minute. Signals keep the set in sync with note
+edits, and a periodic reconciliation against the database restores whatever
+Redis missed.
+"""
+
+import logging
+
+import redis
+from django.db.models import Q
+from django.utils import timezone
+
+from .errors import PERMANENT_ERRORS
+from .models import UNFINISHED_STATUSES
+from .models import Note
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_KEY = "xedule:schedule:notes"
+POP_LIMIT = 1000  # notes popped per dispatcher tick
+RECONCILE_CHUNK_SIZE = 1000
+
+# Pop up to ARGV[2] members scored at or before ARGV[1], the latest first so
+# a backlog never holds back the notes that just became due
+POP_DUE_SCRIPT = """
+local ids = redis.call("ZREVRANGEBYSCORE", KEYS[1], ARGV[1], "-inf", "LIMIT", 0, ARGV[2])
+if #ids > 0 then
+    redis.call("ZREM", KEYS[1], unpack(ids))
+end
+return ids
+"""
+
+
+def _due_at(note):
+    """Return when the note should next be published, None if never."""
+    if (
+        note.status not in UNFINISHED_STATUSES
+        or note.error_code in PERMANENT_ERRORS
+        or note.scheduled_time is None
+    ):
+        return None
+    if note.next_attempt_at is not None:
+        return max(note.scheduled_time, note.next_attempt_at)
+    return note.scheduled_time
+
+
+def schedule_note(note):
+    """Add the note to the timer, or drop it if it has nothing left to do."""
+    due_at = _due_at(note)
+    try:
+        if due_at is None:
+            get_redis().zrem(SCHEDULE_KEY, note.pk)
+        else:
+            get_redis().zadd(SCHEDULE_KEY, {note.pk: due_at.timestamp()})
+    except redis.RedisError:
+        logger.warning("Could not schedule note %s, reconciliation will", note.pk)
+
+
+def unschedule_note(note_id):
+    """Drop a note from the timer."""
+    try:
+        get_redis().zrem(SCHEDULE_KEY, note_id)
+    except redis.RedisError:
+        logger.warning("Could not unschedule note %s, reconciliation will", note_id)
+
+
+def pop_due_note_ids(now=None, limit=POP_LIMIT):
+    """Remove and return the IDs of the notes due at `now`."""
+    now = now or timezone.now()
+    note_ids = get_redis().eval(POP_DUE_SCRIPT, 1, SCHEDULE_KEY, now.timestamp(), limit)
+    return [int(note_id) for note_id in note_ids]
+
+
+def reschedule_unclaimed(note_ids):
+    """Put back in the timer the popped notes no publish task claimed.
+
+    A run pops more notes than its tasks may claim once fair shares and lane
+    limits apply; the rest go back at their due time instead of waiting for
+    the next reconciliation. `note_ids` may be a list or a queryset of note
+    IDs. Returns the number of notes put back.
+    """
+    now = timezone.now()
+    notes = (
+        Note.objects.filter(
+            Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now),
+            id__in=note_ids,
+            status__in=UNFINISHED_STATUSES,
+            scheduled_time__isnull=False,
+        )
+        .exclude(error_code__in=PERMANENT_ERRORS)
+        .only("id", "status", "error_code", "scheduled_time", "next_attempt_at")
+    )
+    due = {note.pk: _due_at(note).timestamp() for note in notes}
+    if not due:
+        return 0
+    try:
+        return get_redis().zadd(SCHEDULE_KEY, due, nx=True)
+    except redis.RedisError:
+        logger.warning(
+            "Could not reschedule %s unclaimed notes, reconciliation will", len(due)
+        )
+        return 0
+
+
+def reconcile_schedule():
+    """Bring the timer in line with the unfinished notes in the database.
+
+    Notes missing from the set, like those popped by a dispatcher that died
+    before publishing them, are added back, and finished or deleted notes are
+    dropped. Notes leased to a publish task are left out until their lease
+    ends. Returns the number of notes added and removed.
+    """
+    client = get_redis()
+    # Read the set before the database, so a note added by a signal meanwhile
+    # is never mistaken for a stale one
+    scheduled = {int(note_id) for note_id in client.zrange(SCHEDULE_KEY, 0, -1)}
+
+    now = timezone.now()
+    notes = (
+        Note.objects.filter(
+            Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now),
+            status__in=UNFINISHED_STATUSES,
+            scheduled_time__isnull=False,
+        )
+        .exclude(error_code__in=PERMANENT_ERRORS)
+        .only("id", "status", "error_code", "scheduled_time", "next_attempt_at")
+        .iterator(chunk_size=RECONCILE_CHUNK_SIZE)
+    )
+
+    expected = set()
+    added = 0
+    missing = {}
+    for note in notes:
+        expected.add(note.pk)
+        if note.pk not in scheduled:
+            missing[note.pk] = _due_at(note).timestamp()
+        if len(missing) >= RECONCILE_CHUNK_SIZE:
+            added += client.zadd(SCHEDULE_KEY, missing, nx=True)
+            missing = {}
+    if missing:
+        added += client.zadd(SCHEDULE_KEY, missing, nx=True)
+
+    stale = list(scheduled - expected)
+    for start in range(0, len(stale), RECONCILE_CHUNK_SIZE):
+        client.zrem(SCHEDULE_KEY, *stale[start : start + RECONCILE_CHUNK_SIZE])
+
+    if added or stale:
+        logger.info(
+            "Schedule reconciled: %s notes added, %s removed", added, len(stale)
+        )
+    return added, len(stale)
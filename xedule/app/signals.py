@@ -1,7 +1,18 @@
 # tweets/signals.py
+from django.db import transaction
 from django_celery_beat.models import IntervalSchedule
 from django_celery_beat.models import PeriodicTask
 
+from .keys import forget_private_key
+from .models import UNFINISHED_STATUSES
+from .models import Note
+from .nostr_events import presign_note
+from .scheduler import schedule_note
+from .scheduler import unschedule_note
+from .tasks import presign_user_notes
+from .tasks import publish_user_tweets
+from .tasks import unpark_user_notes
+
 
 def create_periodic_tasks(sender, **kwargs):
     """
@@ -22,3 +33,77 @@ def create_periodic_tasks(sender, **kwargs):
             "enabled": True,
         },
     )
+
+    # Copiar la salud de los relays de Redis para el admin
+    PeriodicTask.objects.update_or_create(
+        name="Snapshot relay health",
+        defaults={
+            "task": "xedule.app.tasks.snapshot_relay_health",
+            "interval": schedule,
+            "enabled": True,
+        },
+    )
+
+    # Copiar los contadores del lease de publicación para el admin
+    PeriodicTask.objects.update_or_create(
+        name="Snapshot lease stats",
+        defaults={
+            "task": "xedule.app.tasks.snapshot_lease_stats",
+            "interval": schedule,
+            "enabled": True,
+        },
+    )
+
+    # Publicar cada nota en su segundo a partir del temporizador de Redis
+    every_second, _ = IntervalSchedule.objects.get_or_create(
+        every=1,
+        period=IntervalSchedule.SECONDS,
+    )
+    PeriodicTask.objects.update_or_create(
+        name="Dispatch due notes",
+        defaults={
+            "task": "xedule.app.tasks.dispatch_due_notes",
+            "interval": every_second,
+            "enabled": True,
+            # A tick that waited in the queue is superseded by the next one
+            "expire_seconds": 5,
+        },
+    )
+
+
+def sync_note_schedule(sender, instance, **kwargs):
+    """Update the Redis timer once a note edit is committed."""
+    transaction.on_commit(lambda: schedule_note(instance))
+
+
+def remove_note_schedule(sender, instance, **kwargs):
+    """Drop a deleted note from the Redis timer."""
+    note_id = instance.pk
+    transaction.on_commit(lambda: unschedule_note(note_id))
+
+
+def presign_nostr_event(sender, instance, **kwargs):
+    """Sign the Nostr event of a note before it is stored."""
+    presign_note(instance)
+
+
+def resign_nostr_events(sender, instance, **kwargs):
+    """Sign the events of the user's notes again with the new credentials."""
+    forget_private_key(instance.pk)
+    Note.objects.filter(
+        user_id=instance.user_id,
+        status__in=UNFINISHED_STATUSES,
+        nostr_event__isnull=False,
+    ).update(nostr_event=None)
+    user_id = instance.user_id
+    transaction.on_commit(lambda: presign_user_notes.delay(user_id))
+
+
+def unpark_notes(sender, instance, **kwargs):
+    """Queue the notes parked for lack of credentials once they are set."""
+    if not instance.is_configured:
+        return
+
+    user_id = instance.user_id
+    if unpark_user_notes(user_id):
+        transaction.on_commit(lambda: publish_user_tweets.delay([user_id]))
@@ -1,243 +1,789 @@
 import logging
-import ssl
+import random
 import time
-
-import nostr.key as nk
+import uuid
+from collections import Counter
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from itertools import groupby
+from operator import attrgetter
+
+import redis
 import tweepy
+from celery import group
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import Q
+from django.db.models import Value
+from django.db.models import When
 from django.utils import timezone
-from nostr.event import Event
-from nostr.relay_manager import RelayManager
 
 from xedule.users.models import User
 
+from .credential_health import get_credentials_error
+from .credential_health import mark_credentials_broken
+from .errors import AUTH_ERRORS
+from .errors import NOSTR_INVALID_KEY
+from .errors import NOSTR_RATE_LIMITED
+from .errors import PERMANENT
+from .errors import PERMANENT_ERRORS
+from .errors import X_RATE_LIMITED
+from .errors import classify_relay_results
+from .errors import classify_twitter_error
+from .errors import error_kind
+from .errors import most_severe
+from .errors import record_error
+from .fairness import fair_share
+from .fairness import round_robin
+from .keys import InvalidKeyError
+from .keys import get_private_key
+from .lanes import LANE_QUEUES
+from .lanes import LATE
+from .lanes import claim_limit
+from .lanes import lane_filter
+from .lanes import refund_claim_limit
+from .lanes import split_by_lane
+from .lease import Lease
+from .lease import get_lease_stats
+from .lease import lease_contended
+from .models import UNFINISHED_STATUSES
+from .models import LeaseStats
 from .models import NostrCredentials
 from .models import Note
+from .models import RelayHealth
 from .models import TwitterCredentials
+from .nostr_events import build_nostr_event
+from .nostr_events import event_to_dict
+from .nostr_events import get_signed_event
+from .nostr_events import needs_nostr_event
+from .rate_limit import DEFAULT_RETRY_AFTER
+from .rate_limit import RateLimitedError
+from .rate_limit import acquire
+from .rate_limit import record_response
+from .rate_limit import retry_after
+from .relay_health import get_relay_health
+from .relay_health import rank_relays
+from .relay_health import record_delivery
+from .relays import get_relay_pool
+from .scheduler import pop_due_note_ids
+from .scheduler import reconcile_schedule
+from .scheduler import reschedule_unclaimed
+from .twitter import get_twitter_client
 
 logger = logging.getLogger(__name__)
 
 MAX_RETRIES = 3
 BACKOFF_BASE = 2  # seconds
 
+# Lease held by publish runs, and how often beat starts one (seconds)
+PUBLISH_LEASE = "publish"
+PUBLISH_INTERVAL = 60
+DISPATCH_INTERVAL = 1
+
+# RelayHealth fields refreshed from Redis
+RELAY_HEALTH_FIELDS = [
+    "connect_latency",
+    "ack_latency",
+    "failure_rate",
+    "accepted",
+    "failed",
+    "consecutive_failures",
+    "circuit_open_until",
+    "last_delivery_at",
+]
+
+# Note columns read by the publisher. Every field written at the end of a run
+# must be loaded too, or bulk_update would fetch it note by note.
+PUBLISH_NOTE_FIELDS = [
+    "id",
+    "user_id",
+    "content",
+    "scheduled_time",
+    "publish_to_x",
+    "publish_to_nostr",
+    "nostr_event",
+    "status",
+    "published_at",
+    "tweet_id",
+    "nostr_id",
+    "last_error",
+    "error_code",
+    "claimed_by",
+    "claim_expires_at",
+    "attempts",
+    "next_attempt_at",
+]
+
+# Note fields written once at the end of a publish run
+FINAL_FIELDS = [
+    "status",
+    "published_at",
+    "tweet_id",
+    "nostr_id",
+    "last_error",
+    "error_code",
+    "claimed_by",
+    "claim_expires_at",
+    "attempts",
+    "next_attempt_at",
+]
+
 
 @shared_task
 def publish_tweet():
-    """Process pending tweets and publish them to Twitter and/or Nostr."""
-    # Include notes that are pending or partially published
-    pending_notes = Note.objects.filter(
-        status__in=["pending", "published_x", "published_n"],
-        scheduled_time__lte=timezone.now(),
+    """Process pending tweets and publish them to Twitter and/or Nostr.
+
+    The run holds the publish lease. A run started while another holds it
+    only takes the notes the other has not claimed, if any.
+    """
+    with Lease(
+        PUBLISH_LEASE, settings.PUBLISH_RUN_LEASE_SECONDS, interval=PUBLISH_INTERVAL
+    ) as lease:
+        if not lease.acquired:
+            logger.info("Another publish run is going, taking its unclaimed notes")
+        return _publish_or_dispatch(_get_pending_notes())
+
+
+@shared_task
+def dispatch_due_notes():
+    """Publish the notes the Redis timer reports as due this second.
+
+    The run holds the publish lease while it pops and dispatches the notes.
+    While the previous run holds it, ticks leave the due notes in the timer
+    for the first tick after it is done. Fanned-out tasks publish after the
+    lease is released, and their claims keep them from publishing a note
+    twice.
+    """
+    if not settings.PUBLISH_TIMER:
+        return "The publish timer is disabled."
+
+    with Lease(
+        PUBLISH_LEASE, settings.PUBLISH_RUN_LEASE_SECONDS, interval=DISPATCH_INTERVAL
+    ) as lease:
+        if not lease.acquired:
+            return _skip_publish_run()
+
+        note_ids = pop_due_note_ids()
+        if not note_ids:
+            return "There are no tweets pending to be published."
+
+        return _publish_or_dispatch(_get_pending_notes().filter(id__in=note_ids))
+
+
+@shared_task
+def publish_user_tweets(user_ids, lane=None):
+    """Publish the pending notes of the given users, or those in `lane`."""
+    pending_notes = _get_pending_notes().filter(user_id__in=user_ids)
+    if lane is not None:
+        pending_notes = pending_notes.filter(lane_filter(lane))
+    return _publish_pending_notes(pending_notes, lane)
+
+
+@shared_task
+def retry_note(note_id):
+    """Publish a note again once the backoff after a failed attempt is over."""
+    return _publish_pending_notes(
+        _get_pending_notes(ignore_backoff=True).filter(id=note_id)
     )
 
-    if not pending_notes.exists():
+
+@shared_task
+def continue_publish(claim_token, lane=None):
+    """Publish the notes a run claimed but had no time left for.
+
+    Processed notes give their claim back, so the notes still claimed with
+    `claim_token` are exactly those left to publish. Their claims are renewed
+    for another PUBLISH_LEASE_SECONDS, except those that already expired:
+    another task may have claimed those notes since.
+    """
+    now = timezone.now()
+    claimed_notes = Note.objects.filter(
+        claimed_by=claim_token, claim_expires_at__gt=now
+    )
+    renewed = claimed_notes.update(
+        claim_expires_at=now + timedelta(seconds=settings.PUBLISH_LEASE_SECONDS)
+    )
+    logger.info("Continuing with %s notes claimed by %s", renewed, claim_token)
+    return _publish_claimed_notes(claimed_notes, claim_token, lane)
+
+
+def _publish_or_dispatch(pending_notes):
+    """Publish the pending notes here, or fan them out per user.
+
+    Either way the notes go lane by lane, the most punctual first.
+    """
+    lanes = split_by_lane(pending_notes)
+    if not lanes:
         return "There are no tweets pending to be published."
 
+    if settings.PUBLISH_FANOUT:
+        return _dispatch_user_tasks(lanes)
+
+    return "; ".join(_publish_pending_notes(notes, lane) for lane, notes in lanes)
+
+
+def _skip_publish_run():
+    """Log a run skipped because the previous one holds the publish lease."""
+    try:
+        stats = get_lease_stats(PUBLISH_LEASE)
+    except redis.RedisError:
+        stats = {}
+    logger.warning(
+        "The previous publish run is still going, skipping this one. Lease stats: %s",
+        stats,
+    )
+    return "The previous publish run is still going."
+
+
+def _get_pending_notes(*, ignore_backoff=False):
+    """Return the notes that are due, not yet published everywhere and not
+    leased to another publish task.
+
+    Notes waiting out the backoff after a failed attempt are left to their
+    retry_note task unless `ignore_backoff` is set.
+    """
+    now = timezone.now()
+    # Include notes that are pending or partially published, but not those
+    # the other platform rejected for good
+    pending_notes = Note.objects.filter(
+        Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now),
+        status__in=UNFINISHED_STATUSES,
+        scheduled_time__lte=now,
+    ).exclude(error_code__in=PERMANENT_ERRORS)
+    if not ignore_backoff:
+        pending_notes = pending_notes.filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+        )
+    return pending_notes
+
+
+def _publish_pending_notes(pending_notes, lane=None):
+    """Claim a batch of the pending notes and publish it.
+
+    With the Redis timer, the pending notes left unclaimed go back in it once
+    the batch is done, since the dispatcher popped them.
+    """
+    claim_token = uuid.uuid4().hex
+    limit = claim_limit(lane)
+    claimed_notes = _claim_notes(pending_notes, claim_token, limit)
+    refund_claim_limit(lane, limit - len(claimed_notes))
+    try:
+        return _publish_claimed_notes(claimed_notes, claim_token, lane)
+    finally:
+        if settings.PUBLISH_TIMER:
+            reschedule_unclaimed(pending_notes.values("id"))
+
+
+def _publish_claimed_notes(claimed_notes, claim_token, lane=None):
+    """Publish the claimed notes for up to PUBLISH_TIME_BUDGET seconds.
+
+    The notes left once the budget is spent go to a continuation task, so
+    large batches drain over several tasks instead of hitting the soft time
+    limit of the worker.
+    """
+    deadline = time.monotonic() + settings.PUBLISH_TIME_BUDGET
+    users = _load_users(claimed_notes.values("user_id"))
+
     # Group notes by user
-    grouped_notes = _group_tweets_by_user(pending_notes)
+    grouped_notes = _group_tweets_by_user(claimed_notes)
 
     # Process tweets by user
-    published_count = _process_grouped_tweets(grouped_notes)
+    published_count, left_over = _process_grouped_tweets(
+        grouped_notes, users, claim_token, deadline
+    )
 
+    if left_over:
+        continue_publish.apply_async((claim_token, lane), queue=LANE_QUEUES.get(lane))
+        logger.info("Out of time, the remaining notes continue in a new task")
     return f"Se publicaron {published_count} tweets"
 
 
+def _claim_notes(pending_notes, claim_token, limit=None):
+    """Lease up to `limit` pending notes to a publish task.
+
+    The limit defaults to PUBLISH_CLAIM_BATCH_SIZE.
+    Rows locked by a concurrent claim are skipped instead of waited for, so
+    several publishers can drain the queue at the same time without ever
+    picking the same note. The lease expires after PUBLISH_LEASE_SECONDS,
+    which lets another task take over the notes of a task that died. Users
+    only get their fair share of the batch.
+    """
+    if limit is None:
+        limit = settings.PUBLISH_CLAIM_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        note_ids = list(
+            pending_notes.filter(id__in=fair_share(pending_notes, now))
+            .select_for_update(skip_locked=True)
+            .order_by("scheduled_time")
+            .values_list("id", flat=True)[:limit]
+        )
+        Note.objects.filter(id__in=note_ids).update(
+            claimed_by=claim_token,
+            claim_expires_at=now + timedelta(seconds=settings.PUBLISH_LEASE_SECONDS),
+        )
+
+    return Note.objects.filter(id__in=note_ids, claimed_by=claim_token)
+
+
+def _dispatch_user_tasks(lanes):
+    """Fan the pending notes out into per-user publish tasks.
+
+    `lanes` holds (lane, notes) pairs, and the tasks of each lane go to the
+    Celery queue of the lane.
+    """
+    tasks: list = []
+    summaries = []
+    for lane, pending_notes in lanes:
+        user_ids = list(
+            pending_notes.order_by().values_list("user_id", flat=True).distinct()
+        )
+        batches = _split_user_ids(user_ids, settings.PUBLISH_MAX_CONCURRENCY)
+        tasks.extend(
+            publish_user_tweets.s(batch, lane).set(queue=LANE_QUEUES.get(lane))
+            for batch in batches
+        )
+        logger.info(
+            "Dispatched pending notes of %s users in %s tasks to the %s lane",
+            len(user_ids),
+            len(batches),
+            lane,
+        )
+        summaries.append(f"Dispatched {len(user_ids)} users in {len(batches)} tasks")
+
+    group(tasks).apply_async()
+    return "; ".join(summaries)
+
+
+def _split_user_ids(user_ids, max_tasks):
+    """Spread user IDs round-robin over at most `max_tasks` batches."""
+    task_count = max(1, min(max_tasks, len(user_ids)))
+    return [user_ids[i::task_count] for i in range(task_count)]
+
+
 def _group_tweets_by_user(pending_notes):
-    """Group tweets by user_id."""
-    grouped_notes = {}
-    for note in pending_notes:
-        if note.user_id not in grouped_notes:
-            grouped_notes[note.user_id] = []
-        grouped_notes[note.user_id].append(note)
-    return grouped_notes
+    """Yield the notes grouped by user_id as (user_id, notes) pairs.
 
+    Notes are streamed in chunks of PUBLISH_CHUNK_SIZE with only the columns
+    the publisher uses, in weighted round-robin order, so a user comes up
+    once per round with as many notes as their weight. Each group is handed
+    off as soon as it is complete.
+    """
+    notes = round_robin(pending_notes.only(*PUBLISH_NOTE_FIELDS)).iterator(
+        chunk_size=settings.PUBLISH_CHUNK_SIZE
+    )
+    for user_id, user_notes in groupby(notes, key=attrgetter("user_id")):
+        yield user_id, list(user_notes)
 
-def _process_grouped_tweets(grouped_notes):
-    """Process tweets grouped by user."""
-    published_count = 0
 
-    for user_id, user_tweets in grouped_notes.items():
+def _process_grouped_tweets(grouped_notes, users, claim_token, deadline=None):
+    """Process tweets grouped by user.
+
+    Twitter posts go out group by group, while the Nostr events of every user
+    are collected and delivered together, so users that share relays also
+    share the connections to them. Outcomes are delivered and stored every
+    PUBLISH_CHUNK_SIZE notes, which bounds the notes held in memory, for the
+    notes still claimed with `claim_token`.
+
+    A user who cannot publish at all has every note of the run marked along
+    with their first group, and their later groups are skipped.
+
+    Once the `deadline` (a time.monotonic value) passes, no further note is
+    tried, even in the middle of a group. Returns the number of published
+    notes and whether notes were left for later.
+    """
+    published_count = 0
+    results = []
+    nostr_events: dict[str, tuple] = {}
+    seen_users: set[int] = set()
+    set_aside: set[int] = set()
+    left_over = False
+
+    for user_id, user_tweets in grouped_notes:
+        if user_id in set_aside:
+            continue
+        if seen_users and _past(deadline):
+            left_over = True
+            break
+        first_group = user_id not in seen_users
+        seen_users.add(user_id)
         try:
-            user_published = _process_user_tweets(user_id, user_tweets)
-            published_count += user_published
+            user_results = _process_user_tweets(
+                user_id,
+                user_tweets,
+                nostr_events,
+                users.get(user_id),
+                # Nothing of the user was processed yet, so all of their notes
+                # still claimed are left to publish
+                run_notes=(
+                    Note.objects.filter(claimed_by=claim_token, user_id=user_id)
+                    if first_group
+                    else None
+                ),
+                deadline=deadline,
+            )
         except Exception:
             logger.exception("Error processing tweets for user %s", user_id)
+            # Left to a later run rather than to the continuation
+            _release_claims(user_tweets, claim_token)
+        else:
+            if user_results is None:
+                if first_group:
+                    set_aside.add(user_id)
+            else:
+                results.extend(user_results)
+                if len(user_results) < len(user_tweets) and _past(deadline):
+                    # Out of time in the middle of the group
+                    left_over = True
+                    break
+
+        if len(results) >= settings.PUBLISH_CHUNK_SIZE:
+            published_count += _complete_notes(results, nostr_events, claim_token)
+            results = []
+            nostr_events = {}
+
+    return (
+        published_count + _complete_notes(results, nostr_events, claim_token),
+        left_over,
+    )
 
-    return published_count
 
+def _past(deadline):
+    """Tell whether a time.monotonic `deadline`, if any, has passed."""
+    return deadline is not None and time.monotonic() > deadline
 
-def _process_user_tweets(user_id, user_notes):
-    """Process tweets for a specific user."""
-    try:
-        user = User.objects.get(id=user_id)
 
-        # Initialize clients as None to track which platforms are available
-        twitter_client = None
-        nostr_client_data = None
+def _release_claims(notes, claim_token):
+    """Give back the claim on notes that were not processed."""
+    Note.objects.filter(
+        id__in=[note.id for note in notes], claimed_by=claim_token
+    ).update(claimed_by="", claim_expires_at=None)
 
-        # Try to get Twitter credentials
-        try:
-            twitter_credentials = TwitterCredentials.objects.get(user=user)
-            twitter_client = _create_twitter_client(twitter_credentials)
-            logger.info("Twitter client created successfully for user %s", user_id)
-        except TwitterCredentials.DoesNotExist:
-            logger.info(
-                "User %s does not have Twitter credentials configured.", user_id
-            )
 
-        # Try to get Nostr credentials
-        try:
-            nostr_credentials = NostrCredentials.objects.get(user=user)
-            if nostr_credentials.private_key:
-                nostr_client_data = {
-                    "private_key": nostr_credentials.private_key,
-                    "public_key": nostr_credentials.public_key,
-                    "relays": nostr_credentials.get_relay_list(),
-                }
-                logger.info(
-                    "Nostr credentials loaded successfully for user %s", user_id
-                )
-            else:
-                logger.warning(
-                    "User %s has incomplete Nostr credentials (missing private key or relays)",
-                    user_id,
-                )
-        except NostrCredentials.DoesNotExist:
-            logger.info("User %s does not have Nostr credentials configured.", user_id)
+def _complete_notes(results, nostr_events, claim_token):
+    """Deliver the collected Nostr events and store the outcome of the notes."""
+    _deliver_nostr_events(nostr_events)
+    return _finalize_notes(results, claim_token)
 
-        # Check if we have any platform to publish to
-        if not twitter_client and not nostr_client_data:
-            _mark_tweets_with_error(
-                user_notes, "User does not have any platform credentials configured"
-            )
-            logger.error(
-                "User %s has no platform credentials. No notes published.", user_id
+
+def _load_users(user_ids):
+    """Fetch the users of a run along with both of their credentials.
+
+    A single query covers every user, however many there are.
+    """
+    users = User.objects.select_related("twitter_credentials", "nostr_credentials")
+    return {user.id: user for user in users.filter(id__in=user_ids)}
+
+
+def _process_user_tweets(  # noqa: PLR0913
+    user_id, user_notes, nostr_events, user, run_notes=None, deadline=None
+):
+    """Process tweets for a specific user.
+
+    `user` comes with its credentials already loaded, or is None if the user
+    no longer exists. When the user cannot publish at all, `run_notes` (a
+    queryset, by default the given notes) are marked in a single UPDATE and
+    None is returned instead of the results.
+    """
+    if run_notes is None:
+        run_notes = Note.objects.filter(id__in=[note.id for note in user_notes])
+
+    if user is None:
+        _mark_tweets_with_error(run_notes, "User does not exist")
+        logger.error("User %s does not exist. Their notes were not published.", user_id)
+        return None
+
+    # Initialize clients as None to track which platforms are available
+    twitter_client = None
+    twitter_credentials = None
+    twitter_error = None
+    nostr_client_data = None
+    nostr_error = None
+
+    # Try to get Twitter credentials
+    try:
+        twitter_credentials = user.twitter_credentials
+        twitter_error = get_credentials_error(twitter_credentials)
+        if twitter_error:
+            logger.warning(
+                "Skipping Twitter for user %s, credentials rejected: %s",
+                user_id,
+                twitter_error,
             )
-            return 0
+        else:
+            twitter_client = get_twitter_client(twitter_credentials)
+            logger.info("Twitter client ready for user %s", user_id)
+    except TwitterCredentials.DoesNotExist:
+        logger.info("User %s does not have Twitter credentials configured.", user_id)
 
-        # Publish the tweets to available platforms
-        return _publish_user_tweets_refactored(
-            user_notes, twitter_client, nostr_client_data
+    # Try to get Nostr credentials
+    try:
+        nostr_credentials = user.nostr_credentials
+        nostr_error = get_credentials_error(nostr_credentials)
+        if nostr_error:
+            logger.warning(
+                "Skipping Nostr for user %s, credentials rejected: %s",
+                user_id,
+                nostr_error,
+            )
+        elif nostr_credentials.private_key:
+            nostr_client_data = {
+                "credentials": nostr_credentials,
+                "relays": nostr_credentials.get_relay_list(),
+            }
+            logger.info("Nostr credentials loaded successfully for user %s", user_id)
+        else:
+            logger.warning(
+                "User %s has incomplete Nostr credentials (missing private key or relays)",
+                user_id,
+            )
+    except NostrCredentials.DoesNotExist:
+        logger.info("User %s does not have Nostr credentials configured.", user_id)
+
+    # Check if we have any platform to publish to
+    if not twitter_client and not nostr_client_data:
+        _mark_tweets_with_error(
+            run_notes,
+            twitter_error
+            or nostr_error
+            or "User does not have any platform credentials configured",
+            status="parked",
+        )
+        logger.error(
+            "User %s has no platform credentials. No notes published.", user_id
         )
+        return None
+
+    # Publish the tweets to available platforms
+    return _publish_user_tweets_refactored(
+        user_notes,
+        twitter_client,
+        nostr_client_data,
+        nostr_events,
+        twitter_credentials=twitter_credentials,
+        twitter_error=twitter_error,
+        deadline=deadline,
+    )
 
-    except User.DoesNotExist:
-        _mark_tweets_with_error(user_notes, "User does not exist")
-        for note in user_notes:
-            logger.exception(
-                "User %s does not exist. Note %s not published.", user_id, note.id
-            )
-        return 0
 
+def _publish_user_tweets_refactored(  # noqa: PLR0913
+    notes,
+    twitter_client,
+    nostr_client_data,
+    nostr_events,
+    twitter_credentials=None,
+    twitter_error=None,
+    deadline=None,
+):
+    """Publish notes for a user with the given clients.
 
-def _create_twitter_client(credentials):
-    """Create a Twitter API client using user credentials."""
-    return tweepy.Client(
-        consumer_key=credentials.api_key,
-        consumer_secret=credentials.api_secret_key,
-        access_token=credentials.access_token,
-        access_token_secret=credentials.access_token_secret,
-    )
+    Notes go out to Twitter one by one, while the user's Nostr events are all
+    signed up front and added to `nostr_events` for delivery with the rest of
+    the run. Once X rejects the credentials, the remaining notes are parked
+    without trying them. Once the `deadline` passes, the notes not tried yet
+    are left out of the results, still claimed.
+    """
+    # Las notas están reservadas para esta tarea, así que los datos leídos al
+    # reclamarlas siguen vigentes y no hace falta refrescarlas
+    results: list[dict] = []
+    for note in notes:
+        if results and _past(deadline):
+            break
+        result = _process_single_tweet(note, twitter_client, twitter_error)
+        if note.error_code in AUTH_ERRORS:
+            result["parked"] = True
+            twitter_client = None
+            twitter_error = note.last_error
+            mark_credentials_broken(twitter_credentials, twitter_error)
+        results.append(result)
+
+    if nostr_client_data:
+        _sign_notes_for_nostr(results, nostr_client_data, nostr_events)
+    else:
+        for result in results:
+            if result["needs_nostr"]:
+                result["parked"] = True
+                _update_tweet_error(
+                    result["note"], "User does not have Nostr credentials configured"
+                )
+                logger.error(
+                    "Note %s not published to Nostr: No Nostr credentials",
+                    result["note"].id,
+                )
+
+    return results
+
+
+def _finalize_notes(results, claim_token):
+    """Store the final status of the processed notes and count the published.
 
+    Every outcome collected in memory during the run is written here with a
+    single bulk UPDATE for the whole batch. Notes no longer claimed with
+    `claim_token` belong to another task by now and are left to it.
+    """
+    if not results:
+        return 0
 
-def _publish_user_tweets_refactored(notes, twitter_client, nostr_client_data):
-    """Publish notes for a user with the given clients."""
     published_count = 0
+    retries = []
+    with transaction.atomic():
+        results = _still_claimed(results, claim_token)
+        for result in results:
+            note = result["note"]
+
+            # Update the overall status based on publishing results
+            _update_note_final_status(
+                note,
+                result["needs_twitter"],
+                result["needs_nostr"],
+                result["twitter_success"],
+                result["nostr_success"],
+            )
 
-    for note in notes:
-        # Actualizar la nota desde la base de datos para evitar usar datos en caché
-        note.refresh_from_db()
+            # Determine if all required platforms were published to
+            if (not result["needs_twitter"] or result["twitter_success"]) and (
+                not result["needs_nostr"] or result["nostr_success"]
+            ):
+                published_count += 1
+                note.attempts = 0
+                note.next_attempt_at = None
+                _log_successful_publish(note, note.tweet_id, note.nostr_id)
+            elif result.get("parked"):
+                # Waits for the missing credentials instead of retrying
+                note.status = "parked"
+            else:
+                retry = _plan_retry(note, result)
+                if retry is not None:
+                    retries.append((note.id, retry))
 
-        # Procesar la nota para su publicación
-        result = _process_single_tweet(note, twitter_client, nostr_client_data)
+        Note.objects.bulk_update([result["note"] for result in results], FINAL_FIELDS)
 
-        if result["all_completed"]:
-            published_count += 1
-            _log_successful_publish(note, result["twitter_id"], result["nostr_id"])
+    for note_id, countdown in retries:
+        retry_note.apply_async((note_id,), countdown=countdown, queue=LANE_QUEUES[LATE])
 
     return published_count
 
 
-def _process_single_tweet(note, twitter_client, nostr_client_data):
-    """Process a single note for publishing to available platforms."""
-    # Check which platforms need publishing
-    needs_twitter = note.publish_to_x and not note.tweet_id
-    needs_nostr = note.publish_to_nostr and not note.nostr_id
+def _plan_retry(note, result):
+    """Decide what happens to a note some platform failed to publish.
+
+    Each platform the note still misses is judged on its own error, and the
+    note is retried while one of them may still work. Returns the delay
+    before the retry, or None if there is none.
+    """
+    errors = []
+    if result["needs_twitter"] and not result["twitter_success"]:
+        errors.append(result.get("twitter_error", ""))
+    if result["needs_nostr"] and not result["nostr_success"]:
+        errors.append(result.get("nostr_error", ""))
+    # A platform that failed without a code may work next time
+    retryable = [code for code in errors if error_kind(code) != PERMANENT]
+
+    if not retryable:
+        # Retrying would fail the same way. A note published to the other
+        # platform keeps its partial status, and its permanent error code
+        # keeps it out of the due notes.
+        note.error_code = most_severe(errors)
+        note.next_attempt_at = None
+        if not (note.tweet_id or note.nostr_id):
+            note.status = "error"
+        logger.error(
+            "Could not publish note %s: permanent error %s",
+            note.id,
+            note.error_code,
+        )
+        return None
+
+    note.error_code = most_severe(retryable)
+    if "retry_after" in result:
+        note.next_attempt_at = timezone.now() + timedelta(seconds=result["retry_after"])
+        return result["retry_after"]
+    return _schedule_retry(note)
+
+
+def _still_claimed(results, claim_token):
+    """Lock the notes still claimed with `claim_token` and drop the others."""
+    note_ids = [result["note"].id for result in results]
+    claimed = set(
+        Note.objects.select_for_update()
+        .filter(id__in=note_ids, claimed_by=claim_token)
+        .values_list("id", flat=True)
+    )
+    for note_id in note_ids:
+        if note_id not in claimed:
+            logger.warning(
+                "The claim on note %s was lost, leaving it to the task holding it",
+                note_id,
+            )
+    return [result for result in results if result["note"].id in claimed]
 
-    # Track results
-    twitter_success = bool(note.tweet_id)  # Already published?
-    nostr_success = bool(note.nostr_id)  # Already published?
-    twitter_id = note.tweet_id
-    nostr_id = note.nostr_id
 
-    # If nothing to do, return early
-    if not needs_twitter and not needs_nostr:
-        return {"all_completed": True, "twitter_id": twitter_id, "nostr_id": nostr_id}
+def _process_single_tweet(note, twitter_client, twitter_error=None):
+    """Publish a single note to Twitter and report what it still needs.
+
+    Without a client the note is parked, with `twitter_error` as the reason
+    when X rejected the credentials.
+    """
+    # Check which platforms need publishing
+    result = {
+        "note": note,
+        "needs_twitter": note.publish_to_x and not note.tweet_id,
+        "needs_nostr": note.publish_to_nostr and not note.nostr_id,
+        "twitter_success": bool(note.tweet_id),  # Already published?
+        "nostr_success": bool(note.nostr_id),  # Already published?
+    }
+    note.error_code = ""
 
     # Try to publish to Twitter if needed
-    if needs_twitter and twitter_client:
-        tw_success, tw_id = _publish_note_to_twitter(note, twitter_client)
+    if result["needs_twitter"] and twitter_client:
+        try:
+            tw_success, tw_id = _publish_note_to_twitter(note, twitter_client)
+        except RateLimitedError as e:
+            # Deferred until the bucket refills, without spending an attempt
+            result["retry_after"] = e.retry_after
+            result["twitter_error"] = X_RATE_LIMITED
+            record_error(note, X_RATE_LIMITED)
+            _update_tweet_error(note, f"Twitter error: {e}")
+            logger.info("Note %s deferred: %s", note.id, e)
+            return result
+
         if tw_success:
-            # Update note immediately to prevent duplicate publishing
+            # Store the ID durably right away: posting to X is not idempotent,
+            # so a crash before the final write must not lead to a repost
             note.tweet_id = tw_id
-            note.save(update_fields=["tweet_id"])
-            twitter_success = True
-            twitter_id = tw_id
+            Note.objects.filter(pk=note.pk).update(tweet_id=tw_id)
+            result["twitter_success"] = True
             logger.info(
                 "Note %s successfully published to Twitter with ID %s", note.id, tw_id
             )
         else:
+            result["twitter_error"] = note.error_code
             logger.error("Failed to publish note %s to Twitter", note.id)
-    elif needs_twitter and not twitter_client:
-        _update_tweet_error(
-            note, "User does not have Twitter API credentials configured"
-        )
+    elif result["needs_twitter"] and not twitter_client:
+        result["parked"] = True
+        if twitter_error:
+            _update_tweet_error(note, twitter_error)
+        else:
+            _update_tweet_error(
+                note, "User does not have Twitter API credentials configured"
+            )
         logger.error(
             "Note %s not published to Twitter: No Twitter credentials", note.id
         )
 
-    # Check again if we need to publish to Nostr (get fresh data)
-    note.refresh_from_db()
-    if note.publish_to_nostr and not note.nostr_id and nostr_client_data:
-        ns_success, ns_id = _publish_note_to_nostr(note, nostr_client_data)
-        if ns_success:
-            # Update note immediately to prevent duplicate publishing
-            note.nostr_id = ns_id
-            note.save(update_fields=["nostr_id"])
-            nostr_success = True
-            nostr_id = ns_id
-            logger.info(
-                "Note %s successfully published to Nostr with ID %s", note.id, ns_id
-            )
-        else:
-            logger.error("Failed to publish note %s to Nostr", note.id)
-    elif needs_nostr and not nostr_client_data:
-        _update_tweet_error(note, "User does not have Nostr credentials configured")
-        logger.error("Note %s not published to Nostr: No Nostr credentials", note.id)
-
-    # Update the overall status based on publishing results
-    _update_note_final_status(
-        note, needs_twitter, needs_nostr, twitter_success, nostr_success
-    )
-
-    # Determine if all required platforms were published to
-    all_completed = (not needs_twitter or twitter_success) and (
-        not needs_nostr or nostr_success
-    )
-
-    return {
-        "all_completed": all_completed,
-        "twitter_id": twitter_id,
-        "nostr_id": nostr_id,
-    }
+    return result
 
 
 def _update_note_final_status(
     note, needs_twitter, needs_nostr, twitter_success, nostr_success
 ):
-    """Update the final status of the note based on publishing results."""
-    # Refresh to get the most current state
-    note.refresh_from_db()
+    """Set the final status of the note based on publishing results.
 
+    The note is only updated in memory; _finalize_notes stores it.
+    """
     # Determine the appropriate status
     if needs_twitter and needs_nostr:
         if twitter_success and nostr_success:
@@ -255,8 +801,9 @@ def _update_note_final_status(
         note.published_at = timezone.now()
         note.last_error = ""
 
-    # Save the updated note
-    note.save()
+    # Release the lease taken when the note was claimed
+    note.claimed_by = ""
+    note.claim_expires_at = None
 
 
 def _log_successful_publish(note, twitter_id, nostr_id):
@@ -271,7 +818,13 @@ def _log_successful_publish(note, twitter_id, nostr_id):
 
 
 def _publish_note_to_twitter(note, client):
-    """Attempt to publish a note to Twitter with retries."""
+    """Attempt to publish a note to Twitter.
+
+    Failures are classified on the note's error_code; retryable ones are
+    retried later by a retry_note task instead of sleeping in the worker.
+    Raises RateLimitedError when the rate limiter or X itself refuses the
+    post for now.
+    """
     # Double-check if already published to Twitter
     if note.tweet_id:
         logger.info(
@@ -281,183 +834,309 @@ def _publish_note_to_twitter(note, client):
         )
         return True, note.tweet_id
 
-    retries = 0
-    success = False
-    tweet_id = ""
-
-    while retries < MAX_RETRIES and not success:
-        try:
-            response = client.create_tweet(text=note.content)
-            tweet_id = response.data["id"]
-            success = True
-
-        except tweepy.errors.TweepyException as e:
-            _handle_api_error(note, str(e), retries, "Twitter")
-            retries += 1
-
-        except Exception as e:
-            error_msg = f"Twitter error: {e!s}"
-            _update_tweet_error(note, error_msg)
-            logger.exception(
-                "Unexpected error when posting note %s to Twitter", note.id
-            )
-            break
-
-    if not success:
-        logger.error(
-            "Could not post note %s to Twitter after %s attempts.",
-            note.id,
-            MAX_RETRIES,
-        )
-
-    return success, tweet_id
-
+    acquire(client)
+    try:
+        response = client.create_tweet(text=note.content)
+    except tweepy.errors.TooManyRequests as e:
+        headers = e.response.headers
+        record_response(client, headers)
+        raise RateLimitedError(retry_after(headers)) from e
+    except tweepy.errors.TweepyException as e:
+        record_error(note, classify_twitter_error(e))
+        _handle_api_error(note, str(e), "Twitter")
+        return False, ""
+    except Exception as e:
+        record_error(note, classify_twitter_error(e))
+        _update_tweet_error(note, f"Twitter error: {e!s}")
+        logger.exception("Unexpected error when posting note %s to Twitter", note.id)
+        return False, ""
+
+    record_response(client, response.headers)
+    return True, response.json()["data"]["id"]
+
+
+def _sign_notes_for_nostr(results, client_data, nostr_events):
+    """Queue the pending Nostr notes of a user for delivery.
+
+    Most notes carry the event signed when they were saved, so only notes
+    without an up to date one are signed here. `nostr_events` maps each
+    event ID to the event, the relays it goes to and the publish results of
+    its notes; notes of a user with the same content and time share an event.
+    """
+    pending = [result for result in results if result["needs_nostr"]]
+    if not pending:
+        return
 
-def _publish_note_to_nostr(note, client_data):
-    """Attempt to publish a note to Nostr with retries."""
-    # Double-check if already published to Nostr
-    if note.nostr_id:
-        logger.info(
-            "Note %s already published to Nostr (ID: %s), skipping",
-            note.id,
-            note.nostr_id,
+    relays = client_data["relays"]
+    try:
+        for result in pending:
+            event = get_signed_event(result["note"])
+            if event is None:
+                private_key = get_private_key(client_data["credentials"])
+                event = build_nostr_event(result["note"], private_key)
+            nostr_events.setdefault(event.id, (event, relays, []))[2].append(result)
+    except InvalidKeyError:
+        logger.exception("Invalid Nostr private key")
+        mark_credentials_broken(
+            client_data["credentials"], "Nostr error: invalid private key"
         )
-        return True, note.nostr_id
-
-    consistent_timestamp = (
-        int(note.scheduled_time.timestamp())
-        if note.scheduled_time
-        else int(note.created_at.timestamp())
-    )
-
-    retries = 0
-    success = False
-    note_id = ""
-
-    while retries < MAX_RETRIES and not success:
-        # Intentamos una sola vez la publicación - si falla por completo, pasamos a los retries
-        try:
-            # Crear un evento con timestamp consistente
-            private_key = nk.PrivateKey.from_nsec(client_data["private_key"])
-
-            # Crear un evento con ID consistente
-            event = Event(
-                content=note.content,
-                public_key=private_key.public_key.hex(),
-                kind=1,  # Regular note
-                tags=[],  # No tags for simple notes
-                created_at=consistent_timestamp,  # Timestamp consistente
-            )
-
-            # Firmar el evento para finalizar su ID
-            private_key.sign_event(event)
-            note_id = event.id
+        for result in pending:
+            # Waits for the user to fix the key
+            result["parked"] = True
+            result["nostr_error"] = NOSTR_INVALID_KEY
+            record_error(result["note"], NOSTR_INVALID_KEY)
+            _update_tweet_error(result["note"], "Nostr error: invalid private key")
+    except Exception:
+        logger.exception("Error creating Nostr events")
+        for result in pending:
+            _update_tweet_error(result["note"], "Nostr error")
 
-            # Guardar el ID inmediatamente para evitar duplicados en caso de reintento
-            note.nostr_id = note_id
-            note.save(update_fields=["nostr_id"])
 
-            # Ahora publicamos a los relays, incluso si falla esto, ya tenemos el ID
-            success = _publish_to_relays(client_data["relays"], event)
+def _deliver_nostr_events(nostr_events):
+    """Publish the signed events of a run, grouped by relay."""
+    if not nostr_events:
+        return
 
-            if success:
+    routes: dict[str, list] = {}
+    for event, relays, _ in nostr_events.values():
+        for relay_url in relays:
+            routes.setdefault(relay_url, []).append(event)
+    # Leave out relays with an open circuit and contact the fastest first
+    routes = {relay_url: routes[relay_url] for relay_url in rank_relays(routes)}
+
+    published, results = _publish_to_relays(routes)
+    for event_id, (_, _, event_results) in nostr_events.items():
+        for result in event_results:
+            note = result["note"]
+            if event_id in published:
+                note.nostr_id = event_id
+                result["nostr_success"] = True
                 logger.info(
                     "Note %s successfully published to Nostr with ID %s",
                     note.id,
-                    note_id,
+                    event_id,
                 )
+            else:
+                code = classify_relay_results(results.get(event_id, {}))
+                result["nostr_error"] = code
+                record_error(note, code)
+                if code == NOSTR_RATE_LIMITED:
+                    result.setdefault("retry_after", DEFAULT_RETRY_AFTER)
+                _update_tweet_error(note, "Nostr error: not accepted by relays")
+                logger.error("Failed to publish note %s to Nostr", note.id)
 
-        except Exception:
-            logger.exception("Error creating Nostr event for note %s", note.id)
-            _update_tweet_error(note, "Nostr error")
-            success = False
-            retries += 1
-
-    if not success:
-        logger.error(
-            "Could not post note %s to Twitter after %s attempts.",
-            note.id,
-            MAX_RETRIES,
-        )
 
-    return success, note_id
+def _publish_to_relays(routes):
+    """Publish events to relays and wait for their acknowledgements.
 
+    `routes` maps each relay URL to the events it should receive. Returns the
+    IDs of the events accepted by NOSTR_RELAY_QUORUM of their relays, and the
+    answers of the relays to each event.
+    """
+    targets = Counter(event.id for events in routes.values() for event in events)
 
-def _publish_to_relays(relays, event):
-    """Publish an event to the given relays."""
     try:
-        # Create a relay manager
-        relay_manager = RelayManager()
-
-        # Add all the relays
-        for relay_url in relays:
-            relay_manager.add_relay(relay_url)
-            logger.debug("Added relay: %s", relay_url)
-
-        relay_manager.add_relay("wss://nostr-pub.wellorder.net")
-        relay_manager.add_relay("wss://relay.damus.io")
-        relay_manager.add_relay("wss://relay.snort.social")
-        relay_manager.add_relay("wss://relay.primal.net")
-
-        # Connect to all relays
-        relay_manager.open_connections(
-            {
-                "cert_reqs": ssl.CERT_NONE
-            }  # NOTE: This disables ssl certificate verification
+        pool = get_relay_pool()
+        results = pool.deliver(
+            routes,
+            timeout=settings.NOSTR_RELAY_TIMEOUT,
+            quorum=settings.NOSTR_RELAY_QUORUM,
         )
-        time.sleep(1.5)  # Give time for connections to establish
-
-        # Publish the event to all relays
-        relay_manager.publish_event(event)
-        time.sleep(1)  # Give time for the event to be published
-
-        # Close all relay connections
-        relay_manager.close_connections()
-
+        record_delivery(results, pool.pop_connect_latencies())
     except Exception:
         logger.exception("Error publishing to Nostr relays")
-        return False
-    else:
-        logger.info("Event %s published to all relays", event.id)
-        return True
+        return set(), {}
+
+    published = set()
+    for event_id, relay_results in results.items():
+        quorum = min(settings.NOSTR_RELAY_QUORUM, targets[event_id])
+        accepted = [url for url, result in relay_results.items() if result.accepted]
+        for url, result in relay_results.items():
+            if not result.accepted:
+                logger.warning(
+                    "Relay %s did not accept event %s: %s",
+                    url,
+                    event_id,
+                    result.message,
+                )
+
+        if len(accepted) >= quorum:
+            published.add(event_id)
+            logger.info("Event %s accepted by relays %s", event_id, ", ".join(accepted))
+        else:
+            logger.error(
+                "Event %s accepted by %s relays, %s required",
+                event_id,
+                len(accepted),
+                quorum,
+            )
 
+    return published, results
 
-def _handle_api_error(note, error_message, retry_count, platform):
-    """Handle API errors with exponential backoff."""
-    _update_tweet_error(note, f"{platform} error: {error_message}")
 
-    # Calculate backoff time with exponential increase
-    backoff_time = BACKOFF_BASE * (2**retry_count)
+def _handle_api_error(note, error_message, platform):
+    """Record an API error on the note."""
+    _update_tweet_error(note, f"{platform} error: {error_message}")
     logger.warning(
-        "Error publishing note %s to %s (attempt %s): %s. Retrying in %s seconds.",
+        "Error publishing note %s to %s (attempt %s): %s",
         note.id,
         platform,
-        retry_count + 1,
+        note.attempts + 1,
         error_message,
-        backoff_time,
     )
 
-    # Sleep for the calculated backoff time
-    time.sleep(backoff_time)
+
+def _schedule_retry(note):
+    """Count a failed attempt and return the delay before the next one.
+
+    The delay grows exponentially with the number of attempts, plus random
+    jitter so notes that failed together do not retry in lockstep. Returns
+    None once MAX_RETRIES attempts have failed and the note is given up on.
+    """
+    note.attempts += 1
+    if note.attempts >= MAX_RETRIES:
+        note.status = "error"
+        note.next_attempt_at = None
+        logger.error(
+            "Could not publish note %s after %s attempts.", note.id, note.attempts
+        )
+        return None
+
+    backoff = BACKOFF_BASE * 2 ** (note.attempts - 1)
+    countdown = backoff + random.uniform(0, backoff)  # noqa: S311
+    note.next_attempt_at = timezone.now() + timedelta(seconds=countdown)
+    logger.warning(
+        "Retrying note %s in %.1f seconds (attempt %s)",
+        note.id,
+        countdown,
+        note.attempts + 1,
+    )
+    return countdown
 
 
 def _update_tweet_error(note, error_message):
-    """Update the note with the error message."""
+    """Record the error message on the note until its final write."""
     note.last_error = error_message
-    note.save(update_fields=["last_error"])
 
 
-def _mark_tweets_with_error(tweets, error_message):
-    """Mark multiple tweets with the same error message."""
-    for note in tweets:
-        note.status = "error"
-        note.last_error = error_message
-        note.save(update_fields=["status", "last_error"])
+def _mark_tweets_with_error(notes, error_message, status="error"):
+    """Mark a queryset of notes with the same error message in a single UPDATE.
+
+    Notes parked for lack of credentials are left out of the due notes until
+    the user saves credentials.
+    """
+    notes.update(
+        status=status,
+        last_error=error_message,
+        claimed_by="",
+        claim_expires_at=None,
+    )
+
+
+def unpark_user_notes(user_id):
+    """Put the notes parked for lack of credentials back in the queue.
+
+    Notes already published to one platform get their partial status back.
+    Returns the number of notes unparked.
+    """
+    return Note.objects.filter(user_id=user_id, status="parked").update(
+        status=Case(
+            When(~Q(tweet_id=""), then=Value("published_x")),
+            When(~Q(nostr_id=""), then=Value("published_n")),
+            default=Value("pending"),
+        ),
+        last_error="",
+        error_code="",
+    )
+
+
+@shared_task
+def presign_user_notes(user_id):
+    """Sign the Nostr events of the unpublished notes of a user."""
+    credentials = NostrCredentials.objects.filter(user_id=user_id).first()
+    if credentials is None or not credentials.private_key:
+        return "The user has no Nostr key to sign with."
+
+    private_key = get_private_key(credentials)
+    notes = [
+        note
+        for note in Note.objects.filter(
+            user_id=user_id,
+            status__in=UNFINISHED_STATUSES,
+            publish_to_nostr=True,
+            scheduled_time__isnull=False,
+        )
+        if needs_nostr_event(note) and get_signed_event(note) is None
+    ]
+    for note in notes:
+        note.nostr_event = event_to_dict(build_nostr_event(note, private_key))
+    Note.objects.bulk_update(notes, ["nostr_event"])
+    return f"Signed the Nostr events of {len(notes)} notes"
+
+
+@shared_task
+def snapshot_relay_health():
+    """Copy the relay health kept in Redis to the database for the admin."""
+    health = get_relay_health()
+    RelayHealth.objects.bulk_create(
+        [
+            RelayHealth(
+                url=url,
+                connect_latency=stats["connect_latency"],
+                ack_latency=stats["ack_latency"],
+                failure_rate=stats["failure_rate"],
+                accepted=int(stats["accepted"] or 0),
+                failed=int(stats["failed"] or 0),
+                consecutive_failures=int(stats["consecutive_failures"] or 0),
+                circuit_open_until=_from_timestamp(stats["open_until"]),
+                last_delivery_at=_from_timestamp(stats["updated"]),
+            )
+            for url, stats in health.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["url"],
+        update_fields=RELAY_HEALTH_FIELDS,
+    )
+    return f"Saved the health of {len(health)} relays"
+
+
+@shared_task
+def snapshot_lease_stats():
+    """Copy the contention counters of the publish lease to the database."""
+    stats = get_lease_stats(PUBLISH_LEASE)
+    LeaseStats.objects.update_or_create(
+        name=PUBLISH_LEASE,
+        defaults={
+            "acquired": int(stats.get("acquired", 0)),
+            "contended": int(stats.get("contended", 0)),
+            "lost": int(stats.get("lost", 0)),
+            "overruns": int(stats.get("overruns", 0)),
+            "last_duration": stats.get("last_duration"),
+        },
+    )
+    return f"Saved the stats of the {PUBLISH_LEASE} lease"
+
+
+def _from_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=UTC)
 
 
 @shared_task
 def schedule_pending_tweets():
     """
     Periodic task to check and publish scheduled tweets
+
+    With the Redis timer the notes go out from dispatch_due_notes, and this
+    task only reconciles the timer with the database. Otherwise no run is
+    queued while the previous one still holds the publish lease.
     """
+    if settings.PUBLISH_TIMER:
+        added, removed = reconcile_schedule()
+        return f"Schedule reconciled: {added} notes added, {removed} removed"
+
+    if lease_contended(PUBLISH_LEASE):
+        return _skip_publish_run()
+
     return publish_tweet.delay()
@@ -0,0 +1,24 @@
+import fakeredis
+import pytest
+from django.core.cache import cache
+
+from xedule.app.redis_client import get_redis
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch):
+    """Point the app's Redis client at an in-memory server for each test."""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        "redis.Redis.from_url",
+        lambda *args, **kwargs: fakeredis.FakeRedis(server=server),
+    )
+    get_redis.cache_clear()
+    yield get_redis()
+    get_redis.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    """Start each test with an empty Django cache."""
+    cache.clear()
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from factory import Faker
+from factory import LazyFunction
+from factory import SubFactory
+from factory.django import DjangoModelFactory
+from nostr.key import PrivateKey
+
+from xedule.app.models import NostrCredentials
+from xedule.app.models import Note
+from xedule.app.models import TwitterCredentials
+from xedule.users.tests.factories import UserFactory
+
+
+class NoteFactory(DjangoModelFactory[Note]):
+    user = SubFactory(UserFactory)
+    content = Faker("sentence")
+    scheduled_time = LazyFunction(lambda: timezone.now() - timedelta(minutes=1))
+    publish_to_x = True
+
+    class Meta:
+        model = Note
+
+
+class NostrCredentialsFactory(DjangoModelFactory[NostrCredentials]):
+    user = SubFactory(UserFactory)
+    private_key = LazyFunction(lambda: PrivateKey().bech32())
+    public_key = ""
+
+    class Meta:
+        model = NostrCredentials
+
+
+class TwitterCredentialsFactory(DjangoModelFactory[TwitterCredentials]):
+    user = SubFactory(UserFactory)
+    api_key = Faker("pystr")
+    api_secret_key = Faker("pystr")
+    access_token = Faker("pystr")
+    access_token_secret = Faker("pystr")
+
+    class Meta:
+        model = TwitterCredentials
@@ -0,0 +1,34 @@
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from xedule.app.models import Note
+from xedule.app.tests.factories import NoteFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_mark_as_pending_resets_the_publish_state(admin_client):
+    note = NoteFactory.create(
+        status="error",
+        published_at=timezone.now(),
+        tweet_id="123",
+        attempts=3,
+        last_error="Twitter error",
+        error_code="x_server_error",
+        claimed_by="a" * 32,
+        claim_expires_at=timezone.now(),
+    )
+
+    admin_client.post(
+        reverse("admin:app_note_changelist"),
+        {"action": "mark_as_pending", "_selected_action": [note.pk]},
+    )
+
+    note = Note.objects.get(pk=note.pk)
+    assert note.status == "pending"
+    assert note.published_at is None
+    assert note.tweet_id == ""
+    assert note.attempts == 0
+    assert note.last_error == note.error_code == note.claimed_by == ""
+    assert note.claim_expires_at is None
@@ -0,0 +1,126 @@
+from unittest import mock
+
+import pytest
+import tweepy
+from django.urls import reverse
+
+from xedule.app.credential_health import get_credentials_error
+from xedule.app.credential_health import mark_credentials_broken
+from xedule.app.models import TwitterCredentials
+from xedule.app.tasks import publish_user_tweets
+from xedule.app.tests.factories import NoteFactory
+from xedule.app.tests.factories import TwitterCredentialsFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def credentials():
+    return TwitterCredentialsFactory.create()
+
+
+@pytest.fixture
+def unauthorized_client():
+    client = mock.Mock(access_token="token", consumer_key="key")  # noqa: S106
+    response = mock.Mock(status_code=401, reason="Unauthorized")
+    response.json.return_value = {"detail": "Unauthorized"}
+    client.create_tweet.side_effect = tweepy.errors.Unauthorized(response)
+    with mock.patch(
+        "xedule.app.tasks.get_twitter_client", return_value=client
+    ) as get_twitter_client:
+        yield get_twitter_client
+
+
+def test_marked_credentials_stay_broken_until_saved(credentials):
+    updated_at = credentials.updated_at
+
+    mark_credentials_broken(credentials, "401 Unauthorized")
+
+    credentials.refresh_from_db()
+    assert credentials.updated_at == updated_at
+    assert credentials.is_broken
+    assert get_credentials_error(credentials) == "401 Unauthorized"
+
+    credentials.save()
+
+    assert not credentials.is_broken
+    assert get_credentials_error(credentials) is None
+
+
+def test_cache_reports_failures_seen_by_other_workers(credentials):
+    stale = TwitterCredentials.objects.get(pk=credentials.pk)
+
+    mark_credentials_broken(credentials, "401 Unauthorized")
+
+    assert not stale.is_broken
+    assert get_credentials_error(stale) == "401 Unauthorized"
+
+
+def test_rejected_credentials_park_the_notes_of_the_user(
+    credentials, unauthorized_client
+):
+    notes = NoteFactory.create_batch(3, user=credentials.user)
+
+    publish_user_tweets([credentials.user_id])
+
+    client = unauthorized_client.return_value
+    client.create_tweet.assert_called_once()
+    credentials.refresh_from_db()
+    assert credentials.is_broken
+    for note in notes:
+        note.refresh_from_db()
+        assert note.status == "parked"
+        assert note.attempts == 0
+
+
+def test_other_forbidden_answers_fail_only_their_note(credentials):
+    refused, published = NoteFactory.create_batch(2, user=credentials.user)
+    client = mock.Mock(access_token="token", consumer_key="key")  # noqa: S106
+    response = mock.Mock(status_code=403, reason="Forbidden")
+    response.json.return_value = {"detail": "You are not permitted to do this."}
+    tweet = mock.Mock(headers={})
+    tweet.json.return_value = {"data": {"id": "42"}}
+    client.create_tweet.side_effect = [tweepy.errors.Forbidden(response), tweet]
+
+    with mock.patch("xedule.app.tasks.get_twitter_client", return_value=client):
+        publish_user_tweets([credentials.user_id])
+
+    credentials.refresh_from_db()
+    assert not credentials.is_broken
+    refused.refresh_from_db()
+    assert refused.status == "error"
+    assert refused.error_code == "x_forbidden"
+    published.refresh_from_db()
+    assert published.status == "published"
+
+
+def test_broken_credentials_are_skipped_until_saved(
+    credentials, unauthorized_client, django_capture_on_commit_callbacks
+):
+    mark_credentials_broken(credentials, "401 Unauthorized")
+    note = NoteFactory.create(user=credentials.user)
+
+    publish_user_tweets([credentials.user_id])
+
+    unauthorized_client.assert_not_called()
+    note.refresh_from_db()
+    assert note.status == "parked"
+    assert note.last_error == "401 Unauthorized"
+
+    with (
+        mock.patch("xedule.app.tasks.publish_user_tweets.delay"),
+        django_capture_on_commit_callbacks(execute=True),
+    ):
+        credentials.save()
+
+    note.refresh_from_db()
+    assert note.status == "pending"
+
+
+def test_credentials_form_shows_the_failure(client, credentials):
+    mark_credentials_broken(credentials, "401 Unauthorized")
+    client.force_login(credentials.user)
+
+    response = client.get(reverse("twitter_credentials"))
+
+    assert b"401 Unauthorized" in response.content
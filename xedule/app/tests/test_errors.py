@@ -0,0 +1,94 @@
+from unittest import mock
+
+import pytest
+import requests
+import tweepy
+
+from xedule.app.errors import NOSTR_RATE_LIMITED
+from xedule.app.errors import NOSTR_REJECTED
+from xedule.app.errors import NOSTR_UNREACHABLE
+from xedule.app.errors import X_ACCESS_REVOKED
+from xedule.app.errors import X_BAD_REQUEST
+from xedule.app.errors import X_DUPLICATE
+from xedule.app.errors import X_FORBIDDEN
+from xedule.app.errors import X_NETWORK_ERROR
+from xedule.app.errors import X_RATE_LIMITED
+from xedule.app.errors import X_SERVER_ERROR
+from xedule.app.errors import X_UNAUTHORIZED
+from xedule.app.errors import classify_relay_results
+from xedule.app.errors import classify_twitter_error
+from xedule.app.errors import record_error
+from xedule.app.relays import RelayResult
+
+
+def _http_error(error_class, status_code, detail="", **body):
+    response = mock.Mock(status_code=status_code, reason="Error")
+    response.json.return_value = {"detail": detail, **body}
+    return error_class(response)
+
+
+@pytest.mark.parametrize(
+    ("error", "code"),
+    [
+        (_http_error(tweepy.errors.BadRequest, 400, "Text is too long"), X_BAD_REQUEST),
+        (_http_error(tweepy.errors.Unauthorized, 401), X_UNAUTHORIZED),
+        (_http_error(tweepy.errors.Forbidden, 403), X_FORBIDDEN),
+        (
+            _http_error(
+                tweepy.errors.Forbidden,
+                403,
+                "You are not allowed to create a Tweet with duplicate content.",
+            ),
+            X_DUPLICATE,
+        ),
+        (
+            _http_error(
+                tweepy.errors.Forbidden,
+                403,
+                errors=[{"code": 64, "message": "Your account is suspended"}],
+            ),
+            X_ACCESS_REVOKED,
+        ),
+        (
+            _http_error(
+                tweepy.errors.Forbidden,
+                403,
+                type="https://api.twitter.com/2/problems/oauth1-permissions",
+            ),
+            X_ACCESS_REVOKED,
+        ),
+        (_http_error(tweepy.errors.TooManyRequests, 429), X_RATE_LIMITED),
+        (_http_error(tweepy.errors.TwitterServerError, 503), X_SERVER_ERROR),
+        (requests.ConnectionError("reset"), X_NETWORK_ERROR),
+        (tweepy.errors.TweepyException("boom"), X_NETWORK_ERROR),
+    ],
+)
+def test_classify_twitter_error(error, code):
+    assert classify_twitter_error(error) == code
+
+
+@pytest.mark.parametrize(
+    ("messages", "code"),
+    [
+        (["invalid: bad signature", "blocked: not allowed"], NOSTR_REJECTED),
+        (["invalid: bad signature", "timeout"], NOSTR_UNREACHABLE),
+        (["rate-limited: slow down", "blocked: not allowed"], NOSTR_RATE_LIMITED),
+        ([], NOSTR_UNREACHABLE),
+    ],
+)
+def test_classify_relay_results(messages, code):
+    relay_results = {
+        f"wss://relay{i}.example.com": RelayResult(accepted=False, message=message)
+        for i, message in enumerate(messages)
+    }
+
+    assert classify_relay_results(relay_results) == code
+
+
+def test_record_error_keeps_the_most_severe_code():
+    note = mock.Mock(error_code="")
+
+    record_error(note, X_UNAUTHORIZED)
+    record_error(note, NOSTR_UNREACHABLE)
+
+    assert note.error_code == X_UNAUTHORIZED
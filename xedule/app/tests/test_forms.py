@@ -0,0 +1,60 @@
+from nostr.key import PrivateKey
+
+from xedule.app.forms import NostrCredentialsForm
+
+
+class TestNostrCredentialsForm:
+    def test_valid_keys(self):
+        private_key = PrivateKey()
+        form = NostrCredentialsForm(
+            {
+                "private_key": private_key.bech32(),
+                "public_key": private_key.public_key.bech32(),
+                "relay_urls": "",
+            }
+        )
+
+        assert form.is_valid()
+
+    def test_invalid_private_key(self):
+        form = NostrCredentialsForm({"private_key": "nsec1invalid", "public_key": ""})
+
+        assert not form.is_valid()
+        assert "private_key" in form.errors
+
+    def test_public_key_must_match(self):
+        form = NostrCredentialsForm(
+            {
+                "private_key": PrivateKey().bech32(),
+                "public_key": PrivateKey().public_key.bech32(),
+            }
+        )
+
+        assert not form.is_valid()
+        assert list(form.errors) == ["public_key"]
+
+    def test_relay_urls_are_normalized(self):
+        private_key = PrivateKey()
+        form = NostrCredentialsForm(
+            {
+                "private_key": private_key.bech32(),
+                "public_key": private_key.public_key.bech32(),
+                "relay_urls": "wss://Relay.Example.com/\n\nwss://relay.example.com\n",
+            }
+        )
+
+        assert form.is_valid()
+        assert form.cleaned_data["relay_urls"] == "wss://relay.example.com"
+
+    def test_invalid_relay_urls(self):
+        private_key = PrivateKey()
+        form = NostrCredentialsForm(
+            {
+                "private_key": private_key.bech32(),
+                "public_key": private_key.public_key.bech32(),
+                "relay_urls": "https://relay.example.com",
+            }
+        )
+
+        assert not form.is_valid()
+        assert list(form.errors) == ["relay_urls"]
@@ -0,0 +1,73 @@
+from unittest import mock
+
+import pytest
+from nostr.key import PrivateKey
+
+from xedule.app import keys
+from xedule.app.keys import InvalidKeyError
+from xedule.app.keys import clear_private_keys
+from xedule.app.keys import forget_private_key
+from xedule.app.keys import get_private_key
+from xedule.app.keys import parse_private_key
+from xedule.app.tests.factories import NostrCredentialsFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _clear_keys():
+    clear_private_keys()
+    yield
+    clear_private_keys()
+
+
+def test_parse_private_key_round_trips():
+    private_key = PrivateKey()
+
+    assert parse_private_key(private_key.bech32()) == private_key
+
+
+@pytest.mark.parametrize("nsec", ["", "not a key", PrivateKey().public_key.bech32()])
+def test_parse_private_key_rejects_invalid_keys(nsec):
+    with pytest.raises(InvalidKeyError):
+        parse_private_key(nsec)
+
+
+def test_key_is_parsed_once():
+    credentials = NostrCredentialsFactory.create()
+
+    with mock.patch(
+        "xedule.app.keys.parse_private_key", wraps=parse_private_key
+    ) as parse:
+        first = get_private_key(credentials)
+        second = get_private_key(credentials)
+
+    assert first is second
+    parse.assert_called_once()
+
+
+def test_key_is_replaced_when_credentials_change():
+    credentials = NostrCredentialsFactory.create()
+    old_key = get_private_key(credentials)
+
+    credentials.private_key = PrivateKey().bech32()
+    credentials.save()
+
+    assert get_private_key(credentials) != old_key
+
+
+def test_key_expires_after_ttl(monkeypatch):
+    monkeypatch.setattr(keys, "KEY_CACHE_TTL", 0)
+    credentials = NostrCredentialsFactory.create()
+    first = get_private_key(credentials)
+
+    assert get_private_key(credentials) is not first
+
+
+def test_forget_private_key_drops_the_key():
+    credentials = NostrCredentialsFactory.create()
+    first = get_private_key(credentials)
+
+    forget_private_key(credentials.pk)
+
+    assert get_private_key(credentials) is not first
@@ -0,0 +1,93 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.utils import timezone
+
+from xedule.app.lanes import BACKLOG
+from xedule.app.lanes import LATE
+from xedule.app.lanes import ON_TIME
+from xedule.app.lanes import claim_limit
+from xedule.app.lanes import split_by_lane
+from xedule.app.models import Note
+from xedule.app.scheduler import SCHEDULE_KEY
+from xedule.app.scheduler import pop_due_note_ids
+from xedule.app.tasks import _get_pending_notes
+from xedule.app.tasks import publish_tweet
+from xedule.app.tasks import publish_user_tweets
+from xedule.app.tests.factories import NoteFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _due(minutes_ago, **kwargs):
+    return NoteFactory.create(
+        scheduled_time=timezone.now() - timedelta(minutes=minutes_ago), **kwargs
+    )
+
+
+def test_due_notes_are_split_by_lateness():
+    on_time, late, backlog = _due(1), _due(30), _due(180)
+
+    lanes = split_by_lane(_get_pending_notes())
+
+    assert [(lane, list(notes)) for lane, notes in lanes] == [
+        (ON_TIME, [on_time]),
+        (LATE, [late]),
+        (BACKLOG, [backlog]),
+    ]
+
+
+def test_lanes_are_dispatched_to_their_queues(settings):
+    settings.PUBLISH_FANOUT = True
+    _due(1)
+    _due(180)
+
+    with mock.patch("xedule.app.tasks.group") as group:
+        publish_tweet()
+
+    signatures = group.call_args.args[0]
+    assert [
+        (signature.args[1], signature.options["queue"]) for signature in signatures
+    ] == [(ON_TIME, "publish_on_time"), (BACKLOG, "publish_backlog")]
+
+
+def test_backlog_tasks_share_their_budget_per_minute(settings):
+    settings.PUBLISH_BACKLOG_BUDGET = 2
+    first = _due(180)
+    NoteFactory.create_batch(
+        3,
+        user=first.user,
+        scheduled_time=timezone.now() - timedelta(minutes=180),
+    )
+    on_time = _due(1, user=first.user)
+
+    with mock.patch("xedule.app.tasks._process_grouped_tweets") as process:
+        process.return_value = (0, False)
+        publish_user_tweets([first.user_id], BACKLOG)
+
+    claimed = Note.objects.exclude(claimed_by="")
+    assert claimed.count() == 2  # noqa: PLR2004
+    assert on_time not in claimed
+    # Later backlog tasks of the same minute get nothing left to claim
+    assert claim_limit(BACKLOG) == 0
+
+
+def test_backlog_budget_not_claimed_is_given_back(settings):
+    settings.PUBLISH_BACKLOG_BUDGET = 2
+    note = _due(180)
+
+    with mock.patch("xedule.app.tasks._process_grouped_tweets") as process:
+        process.return_value = (0, False)
+        publish_user_tweets([note.user_id], BACKLOG)
+
+    assert claim_limit(BACKLOG) == 1
+
+
+def test_timer_pops_the_latest_due_notes_first(redis):
+    now = timezone.now()
+    redis.zadd(SCHEDULE_KEY, {1: (now - timedelta(hours=3)).timestamp()})
+    redis.zadd(SCHEDULE_KEY, {2: (now - timedelta(seconds=1)).timestamp()})
+
+    assert pop_due_note_ids(now, limit=1) == [2]
+    assert pop_due_note_ids(now, limit=1) == [1]
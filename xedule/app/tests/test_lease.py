@@ -0,0 +1,129 @@
+import time
+from unittest import mock
+
+import pytest
+import redis as redis_lib
+
+from xedule.app.lease import Lease
+from xedule.app.lease import get_lease_stats
+from xedule.app.lease import lease_contended
+from xedule.app.models import LeaseStats
+from xedule.app.scheduler import SCHEDULE_KEY
+from xedule.app.tasks import PUBLISH_LEASE
+from xedule.app.tasks import dispatch_due_notes
+from xedule.app.tasks import publish_tweet
+from xedule.app.tasks import schedule_pending_tweets
+from xedule.app.tasks import snapshot_lease_stats
+from xedule.app.tests.factories import NoteFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_second_holder_is_refused_until_release():
+    with Lease("test", ttl=5) as first:
+        with Lease("test", ttl=5) as second:
+            assert first.acquired
+            assert not second.acquired
+        assert lease_contended("test")
+
+    assert not lease_contended("test")
+    assert get_lease_stats("test") == {
+        "acquired": 1,
+        "contended": 2,
+        "last_duration": mock.ANY,
+    }
+
+
+def test_heartbeat_keeps_a_long_run_holding_the_lease():
+    with Lease("test", ttl=0.3) as lease:
+        time.sleep(0.5)
+        assert lease_contended("test")
+
+    assert not lease.lost
+
+
+def test_lease_taken_by_another_run_is_lost(redis):
+    with Lease("test", ttl=0.3) as lease:
+        redis.set("xedule:lease:test", "other")
+        time.sleep(0.2)
+
+    assert lease.lost
+    assert redis.get("xedule:lease:test") == b"other"
+    assert get_lease_stats("test")["lost"] == 1
+
+
+def test_run_longer_than_its_interval_is_an_overrun():
+    with Lease("test", ttl=5, interval=0):
+        pass
+
+    assert get_lease_stats("test")["overruns"] == 1
+
+
+def test_lease_fails_open_without_redis(redis):
+    with (
+        mock.patch.object(redis, "set", side_effect=redis_lib.ConnectionError),
+        Lease("test", ttl=5) as lease,
+    ):
+        assert lease.acquired
+
+
+def test_tick_is_skipped_while_a_run_holds_the_lease(settings):
+    settings.PUBLISH_TIMER = False
+
+    with (
+        mock.patch("xedule.app.tasks.publish_tweet.delay") as delay,
+        Lease(PUBLISH_LEASE, ttl=5),
+    ):
+        schedule_pending_tweets()
+
+    delay.assert_not_called()
+    assert get_lease_stats(PUBLISH_LEASE)["contended"] == 1
+
+
+def test_publish_run_holds_the_lease():
+    with mock.patch(
+        "xedule.app.tasks._publish_or_dispatch",
+        side_effect=lambda notes: lease_contended(PUBLISH_LEASE),
+    ):
+        assert publish_tweet()
+
+    assert not lease_contended(PUBLISH_LEASE)
+
+
+def test_dispatch_leaves_due_notes_in_the_timer_while_a_run_holds_the_lease(
+    redis, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        note = NoteFactory.create()
+
+    with Lease(PUBLISH_LEASE, ttl=5):
+        result = dispatch_due_notes()
+
+    assert result == "The previous publish run is still going."
+    assert redis.zscore(SCHEDULE_KEY, note.id) is not None
+    assert get_lease_stats(PUBLISH_LEASE)["contended"] == 1
+
+
+def test_fanned_out_run_releases_the_lease_once_dispatched(
+    settings, django_capture_on_commit_callbacks
+):
+    settings.PUBLISH_FANOUT = True
+    with django_capture_on_commit_callbacks(execute=True):
+        NoteFactory.create()
+
+    with mock.patch("xedule.app.tasks.group") as group:
+        dispatch_due_notes()
+
+    group.return_value.apply_async.assert_called_once()
+    assert not lease_contended(PUBLISH_LEASE)
+
+
+def test_snapshot_lease_stats():
+    with Lease(PUBLISH_LEASE, ttl=5), Lease(PUBLISH_LEASE, ttl=5):
+        pass
+
+    snapshot_lease_stats()
+
+    stats = LeaseStats.objects.get(name=PUBLISH_LEASE)
+    assert (stats.acquired, stats.contended, stats.lost) == (1, 1, 0)
+    assert stats.last_duration is not None
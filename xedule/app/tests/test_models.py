@@ -0,0 +1,42 @@
+import pytest
+
+from xedule.app.tests.factories import NostrCredentialsFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_relays_are_normalized_on_save(settings):
+    settings.NOSTR_DEFAULT_RELAYS = ["wss://relay.damus.io"]
+
+    credentials = NostrCredentialsFactory.create(
+        relay_urls="wss://relay.example.com/\nwss://Relay.Damus.io/\n"
+    )
+
+    assert credentials.relays == ["wss://relay.example.com", "wss://relay.damus.io"]
+
+
+def test_relay_list_is_merged_with_current_defaults(settings):
+    settings.NOSTR_DEFAULT_RELAYS = ["wss://relay.damus.io"]
+    credentials = NostrCredentialsFactory.create(
+        relay_urls="wss://relay.example.com\nwss://relay.damus.io"
+    )
+
+    settings.NOSTR_DEFAULT_RELAYS = ["wss://relay.damus.io", "wss://Relay.Primal.net/"]
+    credentials.refresh_from_db()
+
+    assert credentials.get_relay_list() == [
+        "wss://relay.example.com",
+        "wss://relay.damus.io",
+        "wss://relay.primal.net",
+    ]
+
+
+def test_relays_follow_relay_urls_updates(settings):
+    settings.NOSTR_DEFAULT_RELAYS = []
+    credentials = NostrCredentialsFactory.create()
+
+    credentials.relay_urls = "wss://relay.example.com"
+    credentials.save(update_fields=["relay_urls"])
+
+    credentials.refresh_from_db()
+    assert credentials.get_relay_list() == ["wss://relay.example.com"]
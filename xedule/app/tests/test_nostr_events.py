@@ -0,0 +1,91 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+
+from xedule.app.nostr_events import event_from_dict
+from xedule.app.nostr_events import get_signed_event
+from xedule.app.tasks import publish_user_tweets
+from xedule.app.tests.factories import NostrCredentialsFactory
+from xedule.app.tests.factories import NoteFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def credentials():
+    return NostrCredentialsFactory.create()
+
+
+def _nostr_note(credentials, **kwargs):
+    return NoteFactory.create(
+        user=credentials.user, publish_to_x=False, publish_to_nostr=True, **kwargs
+    )
+
+
+def test_note_is_signed_when_saved(credentials):
+    note = _nostr_note(credentials)
+
+    event = event_from_dict(note.nostr_event)
+    assert event.verify()
+    assert event.content == note.content
+    assert event.created_at == int(note.scheduled_time.timestamp())
+
+
+def test_note_without_credentials_is_not_signed():
+    note = NoteFactory.create(publish_to_nostr=True)
+
+    assert note.nostr_event is None
+
+
+def test_edited_note_is_signed_again(credentials):
+    note = _nostr_note(credentials)
+    event_id = note.nostr_event["id"]
+
+    note.scheduled_time -= timedelta(minutes=1)
+    note.save()
+
+    assert note.nostr_event["id"] != event_id
+    assert get_signed_event(note).verify()
+
+
+def test_stale_event_is_not_used(credentials):
+    note = _nostr_note(credentials)
+
+    note.content = "Changed without saving"
+
+    assert get_signed_event(note) is None
+
+
+def test_new_credentials_sign_the_notes_again(
+    credentials, settings, django_capture_on_commit_callbacks
+):
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+    note = _nostr_note(credentials)
+    old_pubkey = note.nostr_event["pubkey"]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        new_credentials = NostrCredentialsFactory.build()
+        credentials.private_key = new_credentials.private_key
+        credentials.save()
+
+    note.refresh_from_db()
+    assert note.nostr_event["pubkey"] != old_pubkey
+    assert get_signed_event(note).verify()
+
+
+def test_publish_sends_the_stored_event_without_signing(credentials):
+    note = _nostr_note(credentials)
+
+    with (
+        mock.patch("xedule.app.tasks.get_private_key") as get_private_key,
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        mock.patch("xedule.app.tasks.retry_note.apply_async"),
+    ):
+        get_relay_pool.return_value.deliver.return_value = {}
+        publish_user_tweets([credentials.user_id])
+
+    get_private_key.assert_not_called()
+    routes = get_relay_pool.return_value.deliver.call_args.args[0]
+    events = {event.id for events in routes.values() for event in events}
+    assert events == {note.nostr_event["id"]}
@@ -0,0 +1,83 @@
+import time
+from unittest import mock
+
+import pytest
+import redis
+
+from xedule.app.rate_limit import DEFAULT_RETRY_AFTER
+from xedule.app.rate_limit import RateLimitedError
+from xedule.app.rate_limit import acquire
+from xedule.app.rate_limit import record_response
+from xedule.app.rate_limit import retry_after
+
+
+@pytest.fixture
+def client():
+    return mock.Mock(access_token="token", consumer_key="key")  # noqa: S106
+
+
+@pytest.fixture(autouse=True)
+def _limits(settings):
+    settings.X_RATE_LIMITS = {"user": (2, 3600), "app": (5, 3600)}
+
+
+def test_acquire_takes_tokens_until_the_bucket_is_empty(client):
+    acquire(client)
+    acquire(client)
+
+    with pytest.raises(RateLimitedError) as excinfo:
+        acquire(client)
+    # One token refills every 1800 seconds
+    assert 0 < excinfo.value.retry_after <= 1800  # noqa: PLR2004
+
+
+def test_users_of_an_app_share_its_bucket(client):
+    for i in range(5):
+        acquire(mock.Mock(access_token=f"token-{i}", consumer_key="key"))
+
+    with pytest.raises(RateLimitedError):
+        acquire(client)
+
+
+def test_empty_bucket_blocks_until_reset(client):
+    reset = int(time.time()) + 600
+    record_response(
+        client, {"x-rate-limit-remaining": "0", "x-rate-limit-reset": str(reset)}
+    )
+
+    with pytest.raises(RateLimitedError) as excinfo:
+        acquire(client)
+    assert 598 < excinfo.value.retry_after <= 600  # noqa: PLR2004
+
+
+def test_headers_refill_the_bucket(client):
+    acquire(client)
+    acquire(client)
+    record_response(
+        client,
+        {"x-rate-limit-remaining": "1", "x-rate-limit-reset": str(int(time.time()))},
+    )
+
+    acquire(client)
+
+
+def test_acquire_lets_calls_through_without_redis(client):
+    with mock.patch(
+        "xedule.app.rate_limit.get_redis",
+        side_effect=redis.ConnectionError("down"),
+    ):
+        for _ in range(10):
+            acquire(client)
+
+
+def test_retry_after_uses_the_exhausted_window():
+    reset = int(time.time()) + 120
+    headers = {
+        "x-rate-limit-remaining": "10",
+        "x-rate-limit-reset": str(reset + 3600),
+        "x-app-limit-24hour-remaining": "0",
+        "x-app-limit-24hour-reset": str(reset),
+    }
+
+    assert 119 < retry_after(headers) <= 121  # noqa: PLR2004
+    assert retry_after({}) == DEFAULT_RETRY_AFTER
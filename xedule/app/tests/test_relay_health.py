@@ -0,0 +1,98 @@
+import time
+from http import HTTPStatus
+
+import pytest
+from django.urls import reverse
+
+from xedule.app.models import RelayHealth
+from xedule.app.relay_health import get_relay_health
+from xedule.app.relay_health import rank_relays
+from xedule.app.relay_health import record_delivery
+from xedule.app.relays import RelayResult
+from xedule.app.tasks import snapshot_relay_health
+
+FAST = "wss://fast.example"
+SLOW = "wss://slow.example"
+DEAD = "wss://dead.example"
+
+
+@pytest.fixture(autouse=True)
+def _circuit(settings):
+    settings.RELAY_CIRCUIT_FAILURES = 2
+    settings.RELAY_CIRCUIT_COOLDOWN = 60
+
+
+def _deliver(url, *, accepted=True, latency=0.1):
+    result = RelayResult(
+        accepted=accepted,
+        message="" if accepted else "timeout",
+        latency=latency if accepted else None,
+    )
+    record_delivery({"event": {url: result}}, {url: 0.05})
+
+
+def test_record_delivery_tracks_latencies_and_failures():
+    _deliver(FAST, latency=0.1)
+    _deliver(FAST, accepted=False)
+
+    health = get_relay_health([FAST])[FAST]
+    assert health["ack_latency"] == pytest.approx(0.1)
+    assert health["connect_latency"] == pytest.approx(0.05)
+    assert health["failure_rate"] == pytest.approx(0.2)
+    assert health["accepted"] == 1
+    assert health["failed"] == 1
+    assert health["open_until"] is None
+
+
+def test_failing_relay_has_its_circuit_opened():
+    _deliver(DEAD, accepted=False)
+    _deliver(DEAD, accepted=False)
+
+    assert get_relay_health([DEAD])[DEAD]["open_until"] > time.time()
+    assert rank_relays([FAST, DEAD]) == [FAST]
+
+
+def test_success_closes_the_circuit():
+    _deliver(DEAD, accepted=False)
+    _deliver(DEAD, accepted=False)
+    _deliver(DEAD)
+
+    assert get_relay_health([DEAD])[DEAD]["open_until"] is None
+
+
+def test_relays_are_ranked_by_latency():
+    _deliver(SLOW, latency=2)
+    _deliver(FAST, latency=0.1)
+
+    assert rank_relays([SLOW, FAST]) == [FAST, SLOW]
+
+
+def test_relays_are_kept_when_every_circuit_is_open():
+    for _ in range(2):
+        _deliver(DEAD, accepted=False)
+
+    assert rank_relays([DEAD]) == [DEAD]
+
+
+@pytest.mark.django_db
+def test_snapshot_relay_health():
+    _deliver(FAST)
+    snapshot_relay_health()
+    _deliver(FAST, accepted=False)
+    snapshot_relay_health()
+
+    relay = RelayHealth.objects.get()
+    assert relay.url == FAST
+    assert relay.accepted == 1
+    assert relay.failed == 1
+    assert relay.last_delivery_at is not None
+
+
+@pytest.mark.django_db
+def test_admin_lists_relay_health(admin_client):
+    RelayHealth.objects.create(url=FAST, failure_rate=0.1)
+
+    response = admin_client.get(reverse("admin:app_relayhealth_changelist"))
+
+    assert response.status_code == HTTPStatus.OK
+    assert FAST in response.content.decode()
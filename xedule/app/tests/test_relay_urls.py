@@ -0,0 +1,31 @@
+import pytest
+
+from xedule.app.relay_urls import merge_relay_urls
+from xedule.app.relay_urls import normalize_relay_url
+
+
+@pytest.mark.parametrize(
+    ("url", "expected"),
+    [
+        ("wss://relay.damus.io/", "wss://relay.damus.io"),
+        (" WSS://Relay.Damus.io:443 ", "wss://relay.damus.io"),
+        ("ws://relay.example.com:8080/path/", "ws://relay.example.com:8080/path"),
+    ],
+)
+def test_normalize_relay_url(url, expected):
+    assert normalize_relay_url(url) == expected
+
+
+@pytest.mark.parametrize("url", ["https://relay.damus.io", "relay.damus.io", "wss://"])
+def test_normalize_relay_url_rejects_other_urls(url):
+    with pytest.raises(ValueError, match="is not a ws:// or wss:// URL"):
+        normalize_relay_url(url)
+
+
+def test_merge_relay_urls_deduplicates():
+    merged = merge_relay_urls(
+        ["wss://relay.damus.io/", "", "not a relay"],
+        ["wss://relay.damus.io", "wss://relay.primal.net"],
+    )
+
+    assert merged == ["wss://relay.damus.io", "wss://relay.primal.net"]
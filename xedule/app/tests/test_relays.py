@@ -0,0 +1,213 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import websockets
+from nostr.event import Event
+
+from xedule.app.relay_health import get_relay_health
+from xedule.app.relays import IDLE_TIMEOUT
+from xedule.app.relays import RelayPool
+from xedule.app.relays import RelayResult
+
+
+class FakeRelay:
+    """A local websocket server recording the messages it receives.
+
+    `accept` is the NIP-20 answer sent back for every event, or None to never
+    answer. The `noise` frames are sent before every answer.
+    """
+
+    def __init__(self, accept=True, noise=()):  # noqa: FBT002
+        self.accept = accept
+        self.noise = list(noise)
+        self.connections = 0
+        self.messages = []
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait(timeout=5)
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}"
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(self._serve())
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+
+    async def _serve(self):
+        return await websockets.serve(self._handle, "127.0.0.1", 0)
+
+    async def _handle(self, websocket):
+        self.connections += 1
+        async for message in websocket:
+            self.messages.append(message)
+            for frame in self.noise:
+                await websocket.send(frame)
+            if self.accept is not None:
+                event = json.loads(message)[1]
+                await websocket.send(json.dumps(["OK", event["id"], self.accept, ""]))
+
+    async def _close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@pytest.fixture
+def relay():
+    fake_relay = FakeRelay()
+    yield fake_relay
+    fake_relay.stop()
+
+
+@pytest.fixture
+def silent_relay():
+    fake_relay = FakeRelay(accept=None)
+    yield fake_relay
+    fake_relay.stop()
+
+
+@pytest.fixture
+def pool():
+    relay_pool = RelayPool()
+    yield relay_pool
+    relay_pool.close()
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+ACCEPTED = RelayResult(accepted=True, message="")
+
+
+def _answers(results):
+    """Drop the latencies, which vary between runs."""
+    return {
+        event_id: {
+            url: result._replace(latency=None) for url, result in relay_results.items()
+        }
+        for event_id, relay_results in results.items()
+    }
+
+
+def _event(content="note", created_at=1):
+    return Event(public_key="a" * 64, content=content, created_at=created_at)
+
+
+def test_publish_reuses_connection(relay, pool):
+    first = _event("first")
+    second = _event("second")
+
+    first_results = pool.publish([relay.url], [first])
+    second_results = pool.publish([relay.url], [second])
+
+    assert _answers(first_results) == {first.id: {relay.url: ACCEPTED}}
+    assert _answers(second_results) == {second.id: {relay.url: ACCEPTED}}
+
+    assert _wait_for(
+        lambda: relay.messages == [first.to_message(), second.to_message()]
+    )
+    assert relay.connections == 1
+
+
+def test_publish_sends_batch_over_one_session(relay, pool):
+    events = [_event(f"note {i}") for i in range(5)]
+
+    results = pool.publish([relay.url], events)
+
+    assert _answers(results) == {event.id: {relay.url: ACCEPTED} for event in events}
+    assert relay.connections == 1
+
+
+def test_publish_reports_unreachable_relay(pool):
+    event = _event()
+    results = pool.publish(["ws://127.0.0.1:9"], [event])
+    assert not results[event.id]["ws://127.0.0.1:9"].accepted
+
+
+def test_publish_reports_rejected_event(pool):
+    rejecting_relay = FakeRelay(accept=False)
+    event = _event()
+    try:
+        results = pool.publish([rejecting_relay.url], [event])
+    finally:
+        rejecting_relay.stop()
+    assert _answers(results) == {
+        event.id: {rejecting_relay.url: RelayResult(accepted=False, message="")}
+    }
+
+
+def test_malformed_frames_do_not_stop_the_reader(pool):
+    noisy_relay = FakeRelay(noise=["{}", "5", json.dumps(["OK", 5, True, ""])])
+    events = [_event("first"), _event("second")]
+    try:
+        results = [pool.publish([noisy_relay.url], [event]) for event in events]
+    finally:
+        noisy_relay.stop()
+    assert [_answers(result) for result in results] == [
+        {event.id: {noisy_relay.url: ACCEPTED}} for event in events
+    ]
+    assert noisy_relay.connections == 1
+
+
+def test_publish_times_out_silent_relay(silent_relay, pool):
+    event = _event()
+    results = pool.publish([silent_relay.url], [event], timeout=0.2)
+    assert results == {
+        event.id: {silent_relay.url: RelayResult(accepted=False, message="timeout")}
+    }
+
+
+def test_publish_returns_once_quorum_is_reached(relay, silent_relay, pool):
+    event = _event()
+    started = time.monotonic()
+
+    results = pool.publish([relay.url, silent_relay.url], [event], quorum=1)
+
+    assert time.monotonic() - started < 1
+    assert _answers(results) == {event.id: {relay.url: ACCEPTED}}
+
+
+def test_relays_answering_after_the_quorum_are_recorded(relay, silent_relay, pool):
+    event = _event()
+
+    pool.publish([relay.url, silent_relay.url], [event], timeout=0.2, quorum=1)
+
+    def silent_relay_failed():
+        return get_relay_health([silent_relay.url])[silent_relay.url]["failed"] == 1
+
+    assert _wait_for(silent_relay_failed)
+    assert get_relay_health([relay.url])[relay.url]["accepted"] is None
+
+
+def test_publish_measures_latencies(relay, pool):
+    event = _event()
+
+    results = pool.publish([relay.url], [event])
+
+    assert 0 <= results[event.id][relay.url].latency < 1
+    assert list(pool.pop_connect_latencies()) == [relay.url]
+    assert pool.pop_connect_latencies() == {}
+
+
+def test_idle_connections_are_evicted(relay, pool):
+    pool.publish([relay.url], [_event()])
+
+    pool.run(pool._evict_idle(now=time.monotonic() + IDLE_TIMEOUT + 1))  # noqa: SLF001
+
+    assert pool.connections == {}
@@ -0,0 +1,150 @@
+from datetime import datetime
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.utils import timezone
+
+from xedule.app.models import Note
+from xedule.app.scheduler import SCHEDULE_KEY
+from xedule.app.scheduler import pop_due_note_ids
+from xedule.app.scheduler import reconcile_schedule
+from xedule.app.tasks import dispatch_due_notes
+from xedule.app.tasks import schedule_pending_tweets
+from xedule.app.tests.factories import NoteFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def _timestamp(moment: datetime | None) -> float:
+    assert moment is not None
+    return moment.timestamp()
+
+
+def _scheduled(redis):
+    return {
+        int(note_id): score
+        for note_id, score in redis.zrange(SCHEDULE_KEY, 0, -1, withscores=True)
+    }
+
+
+def test_saved_note_is_scheduled_at_its_time(redis, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        note = NoteFactory.create()
+
+    assert _scheduled(redis) == {note.id: _timestamp(note.scheduled_time)}
+
+
+def test_edited_note_is_rescheduled(redis, django_capture_on_commit_callbacks):
+    note = NoteFactory.create()
+    note.scheduled_time = timezone.now() + timedelta(hours=1)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        note.save()
+
+    assert _scheduled(redis) == {note.id: _timestamp(note.scheduled_time)}
+
+
+def test_finished_and_deleted_notes_leave_the_timer(
+    redis, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        published, deleted = NoteFactory.create_batch(2)
+    assert len(_scheduled(redis)) == 2  # noqa: PLR2004
+
+    with django_capture_on_commit_callbacks(execute=True):
+        published.status = "published"
+        published.save()
+        deleted.delete()
+
+    assert _scheduled(redis) == {}
+
+
+def test_pop_due_note_ids_only_returns_due_notes(
+    redis, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        due = NoteFactory.create()
+        later = NoteFactory.create(scheduled_time=timezone.now() + timedelta(minutes=5))
+
+    assert pop_due_note_ids() == [due.id]
+    assert pop_due_note_ids() == []
+    assert list(_scheduled(redis)) == [later.id]
+
+
+def test_reconcile_adds_missing_and_drops_stale_notes(redis):
+    missing = NoteFactory.create()
+    published = NoteFactory.create(status="published")
+    redis.zadd(SCHEDULE_KEY, {published.id: 0, 999999: 0})
+
+    assert reconcile_schedule() == (1, 2)
+    assert _scheduled(redis) == {missing.id: _timestamp(missing.scheduled_time)}
+
+
+def test_reconcile_schedules_retries_after_their_backoff(redis):
+    note = NoteFactory.create(next_attempt_at=timezone.now() + timedelta(seconds=30))
+
+    reconcile_schedule()
+
+    assert _scheduled(redis) == {note.id: _timestamp(note.next_attempt_at)}
+
+
+def test_reconcile_drops_notes_a_platform_rejected_for_good(redis):
+    note = NoteFactory.create(
+        status="published_x", tweet_id="42", error_code="nostr_rejected"
+    )
+    redis.zadd(SCHEDULE_KEY, {note.id: 0})
+
+    assert reconcile_schedule() == (0, 1)
+    assert _scheduled(redis) == {}
+
+
+def test_minute_task_only_reconciles(redis, settings):
+    settings.PUBLISH_TIMER = True
+    note = NoteFactory.create()
+
+    with mock.patch("xedule.app.tasks.publish_tweet.delay") as delay:
+        schedule_pending_tweets()
+
+    delay.assert_not_called()
+    assert list(_scheduled(redis)) == [note.id]
+
+
+def test_dispatch_due_notes_publishes_popped_notes(
+    settings, django_capture_on_commit_callbacks
+):
+    settings.PUBLISH_TIMER = True
+    settings.PUBLISH_FANOUT = False
+    with django_capture_on_commit_callbacks(execute=True):
+        note = NoteFactory.create()
+        NoteFactory.create(scheduled_time=timezone.now() + timedelta(minutes=5))
+
+    with mock.patch(
+        "xedule.app.tasks._process_grouped_tweets", return_value=(0, False)
+    ) as process:
+        dispatch_due_notes()
+
+    grouped_notes = process.call_args.args[0]
+    assert [n.id for _, notes in grouped_notes for n in notes] == [note.id]
+    assert Note.objects.get(id=note.id).claimed_by
+
+
+def test_popped_notes_left_unclaimed_go_back_in_the_timer(
+    settings, redis, django_capture_on_commit_callbacks
+):
+    settings.PUBLISH_TIMER = True
+    settings.PUBLISH_FANOUT = False
+    settings.PUBLISH_CLAIM_BATCH_SIZE = 1
+    scheduled_time = timezone.now() - timedelta(seconds=30)
+    with django_capture_on_commit_callbacks(execute=True):
+        first = NoteFactory.create(scheduled_time=scheduled_time)
+        second = NoteFactory.create(scheduled_time=scheduled_time)
+
+    with mock.patch(
+        "xedule.app.tasks._process_grouped_tweets", return_value=(0, False)
+    ):
+        dispatch_due_notes()
+
+    claimed = Note.objects.exclude(claimed_by="").get()
+    unclaimed = second if claimed == first else first
+    assert _scheduled(redis) == {unclaimed.id: _timestamp(scheduled_time)}
@@ -0,0 +1,677 @@
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+import tweepy
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from xedule.app.models import Note
+from xedule.app.relays import RelayResult
+from xedule.app.tasks import _claim_notes
+from xedule.app.tasks import _get_pending_notes
+from xedule.app.tasks import _group_tweets_by_user
+from xedule.app.tasks import _split_user_ids
+from xedule.app.tasks import continue_publish
+from xedule.app.tasks import publish_tweet
+from xedule.app.tasks import publish_user_tweets
+from xedule.app.tasks import retry_note
+from xedule.app.tests.factories import NostrCredentialsFactory
+from xedule.app.tests.factories import NoteFactory
+from xedule.app.tests.factories import TwitterCredentialsFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_split_user_ids_respects_cap():
+    batches = _split_user_ids([1, 2, 3, 4, 5], 2)
+    assert batches == [[1, 3, 5], [2, 4]]
+
+
+def test_split_user_ids_with_fewer_users_than_cap():
+    assert _split_user_ids([7], 8) == [[7]]
+
+
+def test_publish_tweet_fans_out_per_user(settings):
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+    settings.PUBLISH_FANOUT = True
+    settings.PUBLISH_MAX_CONCURRENCY = 2
+    notes = NoteFactory.create_batch(3)
+    NoteFactory.create(user=notes[0].user)
+
+    with mock.patch(
+        "xedule.app.tasks._process_user_tweets", return_value=[]
+    ) as process_user:
+        result = publish_tweet.delay()
+
+    assert result.result == "Dispatched 3 users in 2 tasks"
+    processed: Counter[int] = Counter()
+    for call in process_user.mock_calls:
+        processed[call.args[0]] += len(call.args[1])
+    assert processed == {
+        notes[0].user_id: 2,
+        notes[1].user_id: 1,
+        notes[2].user_id: 1,
+    }
+
+
+def _accept_everything(routes, **kwargs):
+    accepted = RelayResult(accepted=True, message="")
+    results: dict[str, dict[str, RelayResult]] = {}
+    for relay_url, events in routes.items():
+        for event in events:
+            results.setdefault(event.id, {})[relay_url] = accepted
+    return results
+
+
+def test_publish_user_tweets_batches_nostr_events():
+    credentials = NostrCredentialsFactory.create()
+    notes = NoteFactory.create_batch(
+        3, user=credentials.user, publish_to_x=False, publish_to_nostr=True
+    )
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        deliver = get_relay_pool.return_value.deliver
+        deliver.side_effect = _accept_everything
+        result = publish_user_tweets([credentials.user_id])
+
+    assert result == "Se publicaron 3 tweets"
+    deliver.assert_called_once()
+    routes = deliver.call_args.args[0]
+    assert all(len(events) == len(notes) for events in routes.values())
+    event_ids = {event.id for events in routes.values() for event in events}
+    for note in notes:
+        note.refresh_from_db()
+        assert note.status == "published"
+        assert note.nostr_id in event_ids
+
+
+def test_identical_notes_of_a_user_are_both_published():
+    credentials = NostrCredentialsFactory.create()
+    first, second = NoteFactory.create_batch(
+        2,
+        user=credentials.user,
+        content="Same note",
+        scheduled_time=timezone.now() - timedelta(minutes=1),
+        publish_to_x=False,
+        publish_to_nostr=True,
+    )
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        get_relay_pool.return_value.deliver.side_effect = _accept_everything
+        publish_user_tweets([credentials.user_id])
+
+    first.refresh_from_db()
+    second.refresh_from_db()
+    assert first.status == second.status == "published"
+    assert first.nostr_id == second.nostr_id
+
+
+def test_publish_user_tweets_shares_relays_between_users():
+    first, second = NostrCredentialsFactory.create_batch(2)
+    second.relay_urls = "wss://relay.example.com"
+    second.save()
+    first_note = NoteFactory.create(
+        user=first.user, publish_to_x=False, publish_to_nostr=True
+    )
+    second_note = NoteFactory.create(
+        user=second.user, publish_to_x=False, publish_to_nostr=True
+    )
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        deliver = get_relay_pool.return_value.deliver
+        deliver.side_effect = _accept_everything
+        publish_user_tweets([first.user_id, second.user_id])
+
+    deliver.assert_called_once()
+    routes = deliver.call_args.args[0]
+    first_note.refresh_from_db()
+    second_note.refresh_from_db()
+    assert {event.id for event in routes["wss://relay.damus.io"]} == {
+        first_note.nostr_id,
+        second_note.nostr_id,
+    }
+    assert [event.id for event in routes["wss://relay.example.com"]] == [
+        second_note.nostr_id
+    ]
+
+
+def test_claim_notes_skips_notes_leased_to_another_task():
+    free_note = NoteFactory.create()
+    NoteFactory.create(
+        claimed_by="other",
+        claim_expires_at=timezone.now() + timedelta(minutes=1),
+    )
+    expired_note = NoteFactory.create(
+        claimed_by="crashed",
+        claim_expires_at=timezone.now() - timedelta(minutes=1),
+    )
+
+    claimed = _claim_notes(_get_pending_notes(), "mine")
+
+    assert {note.id for note in claimed} == {free_note.id, expired_note.id}
+    assert all(note.claimed_by == "mine" for note in claimed)
+    assert all(note.claim_expires_at > timezone.now() for note in claimed)
+
+
+def test_claim_notes_respects_batch_size(settings):
+    settings.PUBLISH_CLAIM_BATCH_SIZE = 2
+    NoteFactory.create_batch(3)
+
+    assert _claim_notes(_get_pending_notes(), "mine").count() == 2  # noqa: PLR2004
+
+
+def test_published_note_releases_its_claim():
+    credentials = NostrCredentialsFactory.create()
+    note = NoteFactory.create(
+        user=credentials.user, publish_to_x=False, publish_to_nostr=True
+    )
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        get_relay_pool.return_value.deliver.side_effect = _accept_everything
+        publish_user_tweets([credentials.user_id])
+
+    note.refresh_from_db()
+    assert note.status == "published"
+    assert note.claimed_by == ""
+    assert note.claim_expires_at is None
+
+
+def _count_publish_queries(note_count):
+    credentials = NostrCredentialsFactory.create()
+    NoteFactory.create_batch(
+        note_count, user=credentials.user, publish_to_x=False, publish_to_nostr=True
+    )
+    with (
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        CaptureQueriesContext(connection) as queries,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = _accept_everything
+        publish_user_tweets([credentials.user_id])
+    return len(queries)
+
+
+def test_publish_writes_notes_in_one_batch():
+    assert _count_publish_queries(1) == _count_publish_queries(4)
+
+
+def _count_run_queries(user_count):
+    credentials = NostrCredentialsFactory.create_batch(user_count)
+    for item in credentials:
+        TwitterCredentialsFactory.create(user=item.user)
+        NoteFactory.create(user=item.user, publish_to_x=False, publish_to_nostr=True)
+    user_ids = [item.user_id for item in credentials]
+    with (
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        CaptureQueriesContext(connection) as queries,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = _accept_everything
+        assert publish_user_tweets(user_ids) == f"Se publicaron {user_count} tweets"
+    return len(queries)
+
+
+def test_publish_loads_users_in_constant_queries():
+    assert _count_run_queries(1) == _count_run_queries(5)
+
+
+@pytest.fixture
+def failing_twitter_client():
+    client = mock.Mock(access_token="token", consumer_key="key")  # noqa: S106
+    client.create_tweet.side_effect = tweepy.errors.TweepyException("boom")
+    with mock.patch("xedule.app.tasks.get_twitter_client", return_value=client):
+        yield client
+
+
+def test_failed_post_is_retried_later(failing_twitter_client):
+    credentials = TwitterCredentialsFactory.create()
+    note = NoteFactory.create(user=credentials.user)
+
+    with mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async:
+        publish_user_tweets([credentials.user_id])
+
+    failing_twitter_client.create_tweet.assert_called_once()
+    note.refresh_from_db()
+    assert note.status == "pending"
+    assert note.attempts == 1
+    assert note.last_error == "Twitter error: boom"
+    assert note.error_code == "x_network_error"
+    assert note.next_attempt_at is not None
+    assert note.next_attempt_at > timezone.now()
+    apply_async.assert_called_once()
+    assert apply_async.call_args.args == ((note.id,),)
+    assert 2 <= apply_async.call_args.kwargs["countdown"] <= 4  # noqa: PLR2004
+    assert not _get_pending_notes().filter(id=note.id).exists()
+
+
+def test_note_is_given_up_after_max_retries(failing_twitter_client):
+    credentials = TwitterCredentialsFactory.create()
+    note = NoteFactory.create(user=credentials.user, attempts=2)
+
+    with mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async:
+        retry_note(note.id)
+
+    note.refresh_from_db()
+    assert note.status == "error"
+    assert note.attempts == 3  # noqa: PLR2004
+    apply_async.assert_not_called()
+
+
+def test_permanent_error_fails_the_note_without_retrying():
+    credentials = TwitterCredentialsFactory.create()
+    note = NoteFactory.create(user=credentials.user)
+    client = mock.Mock(access_token="token", consumer_key="key")  # noqa: S106
+    response = mock.Mock(status_code=403, reason="Forbidden")
+    response.json.return_value = {
+        "detail": "You are not allowed to create a Tweet with duplicate content."
+    }
+    client.create_tweet.side_effect = tweepy.errors.Forbidden(response)
+
+    with (
+        mock.patch("xedule.app.tasks.get_twitter_client", return_value=client),
+        mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async,
+    ):
+        publish_user_tweets([credentials.user_id])
+
+    note.refresh_from_db()
+    assert note.status == "error"
+    assert note.error_code == "x_duplicate"
+    assert note.attempts == 0
+    apply_async.assert_not_called()
+
+
+def _reject_everything(routes, **kwargs):
+    refused = RelayResult(accepted=False, message="invalid: bad signature")
+    return {
+        event.id: {relay_url: refused}
+        for relay_url, events in routes.items()
+        for event in events
+    }
+
+
+def _note_for_both_platforms():
+    credentials = NostrCredentialsFactory.create()
+    TwitterCredentialsFactory.create(user=credentials.user)
+    return NoteFactory.create(
+        user=credentials.user, publish_to_x=True, publish_to_nostr=True
+    )
+
+
+def test_permanent_error_on_one_platform_still_retries_the_other(
+    failing_twitter_client,
+):
+    note = _note_for_both_platforms()
+
+    with (
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = _reject_everything
+        publish_user_tweets([note.user_id])
+
+    note.refresh_from_db()
+    assert note.status == "pending"
+    assert note.error_code == "x_network_error"
+    assert note.attempts == 1
+    apply_async.assert_called_once()
+
+
+def test_partial_note_keeps_its_status_when_the_other_platform_fails_for_good():
+    note = _note_for_both_platforms()
+    client = mock.Mock(access_token="token", consumer_key="key")  # noqa: S106
+    client.create_tweet.return_value.json.return_value = {"data": {"id": "42"}}
+    client.create_tweet.return_value.headers = {}
+
+    with (
+        mock.patch("xedule.app.tasks.get_twitter_client", return_value=client),
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = _reject_everything
+        publish_user_tweets([note.user_id])
+
+    note.refresh_from_db()
+    assert note.status == "published_x"
+    assert note.tweet_id == "42"
+    assert note.error_code == "nostr_rejected"
+    assert note.next_attempt_at is None
+    apply_async.assert_not_called()
+    assert not _get_pending_notes().filter(id=note.id).exists()
+
+
+def test_rate_limited_relays_defer_the_note():
+    credentials = NostrCredentialsFactory.create()
+    note = NoteFactory.create(
+        user=credentials.user, publish_to_x=False, publish_to_nostr=True
+    )
+
+    def rate_limited(routes, **kwargs):
+        refused = RelayResult(accepted=False, message="rate-limited: slow down")
+        return {
+            event.id: {relay_url: refused}
+            for relay_url, events in routes.items()
+            for event in events
+        }
+
+    with (
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = rate_limited
+        publish_user_tweets([credentials.user_id])
+
+    note.refresh_from_db()
+    assert note.status == "pending"
+    assert note.error_code == "nostr_rate_limited"
+    assert note.attempts == 0
+    assert apply_async.call_args.kwargs["countdown"] == 60  # noqa: PLR2004
+
+
+def test_rate_limited_note_is_deferred_without_spending_an_attempt(settings):
+    settings.X_RATE_LIMITS = {"user": (1, 3600), "app": (100, 3600)}
+    credentials = TwitterCredentialsFactory.create()
+    first, second = NoteFactory.create_batch(2, user=credentials.user)
+    client = mock.Mock(access_token="token", consumer_key="key")  # noqa: S106
+    client.create_tweet.return_value.json.return_value = {"data": {"id": "42"}}
+    client.create_tweet.return_value.headers = {}
+
+    with (
+        mock.patch("xedule.app.tasks.get_twitter_client", return_value=client),
+        mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async,
+    ):
+        publish_user_tweets([credentials.user_id])
+
+    client.create_tweet.assert_called_once()
+    first.refresh_from_db()
+    second.refresh_from_db()
+    deferred, published = sorted([first, second], key=lambda note: note.status)
+    assert published.status == "published"
+    assert published.tweet_id == "42"
+    assert deferred.status == "pending"
+    assert deferred.attempts == 0
+    assert deferred.next_attempt_at is not None
+    assert deferred.next_attempt_at > timezone.now()
+    apply_async.assert_called_once()
+    assert apply_async.call_args.args == ((deferred.id,),)
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Partial indexes are planned by Postgres"
+)
+def test_due_notes_query_uses_partial_index():
+    user = NoteFactory.create().user
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO app_note (
+                user_id, content, status, scheduled_time, created_at,
+                published_at, tweet_id, publish_to_nostr, publish_to_x,
+                nostr_id, last_error, error_code, claimed_by, attempts
+            )
+            SELECT %s, 'published', 'published', now() - n * interval '1 minute',
+                now(), now(), '', false, true, '', '', '', '', 0
+            FROM generate_series(1, 1000000) AS n
+            """,
+            [user.id],
+        )
+        cursor.execute("ANALYZE app_note")
+
+    plan = _get_pending_notes().explain()
+
+    assert "note_due_idx" in plan
+
+
+def test_publish_streams_notes_in_chunks(settings):
+    settings.PUBLISH_CHUNK_SIZE = 2
+    users = [NostrCredentialsFactory.create().user for _ in range(3)]
+    for user in users:
+        NoteFactory.create_batch(
+            2, user=user, publish_to_x=False, publish_to_nostr=True
+        )
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        deliver = get_relay_pool.return_value.deliver
+        deliver.side_effect = _accept_everything
+        result = publish_user_tweets([user.id for user in users])
+
+    assert result == "Se publicaron 6 tweets"
+    # One delivery per completed chunk of notes
+    assert deliver.call_count == 3  # noqa: PLR2004
+
+
+def test_group_tweets_by_user_interleaves_users():
+    first, second = NoteFactory.create(), NoteFactory.create()
+    NoteFactory.create(user=first.user)
+
+    groups = list(_group_tweets_by_user(Note.objects.all()))
+
+    assert [(user_id, len(notes)) for user_id, notes in groups] == [
+        (first.user_id, 1),
+        (second.user_id, 1),
+        (first.user_id, 1),
+    ]
+    assert "created_at" in groups[0][1][0].get_deferred_fields()
+
+
+def test_weighted_users_get_more_notes_per_round(settings):
+    settings.PUBLISH_PLAN_WEIGHTS = {"pro": 2}
+    free, pro = NoteFactory.create(), NoteFactory.create()
+    NoteFactory.create(user=free.user)
+    NoteFactory.create_batch(2, user=pro.user)
+    pro.user.groups.add(Group.objects.create(name="pro"))
+
+    groups = _group_tweets_by_user(Note.objects.all())
+
+    assert [(user_id, len(notes)) for user_id, notes in groups] == [
+        (pro.user_id, 2),
+        (free.user_id, 1),
+        (pro.user_id, 1),
+        (free.user_id, 1),
+    ]
+
+
+def test_claim_caps_the_notes_in_flight_per_user(settings):
+    settings.PUBLISH_USER_INFLIGHT = 2
+    busy = NoteFactory.create()
+    NoteFactory.create_batch(4, user=busy.user)
+    quiet = NoteFactory.create()
+
+    claimed = _claim_notes(_get_pending_notes(), "first")
+    assert sorted(note.user_id for note in claimed) == sorted(
+        [busy.user_id, busy.user_id, quiet.user_id]
+    )
+
+    # Notes still claimed by the first run count against the cap
+    assert not _claim_notes(_get_pending_notes(), "second").exists()
+
+
+def test_claim_cap_grows_with_the_weight_of_the_user(settings):
+    settings.PUBLISH_USER_INFLIGHT = 1
+    settings.PUBLISH_PLAN_WEIGHTS = {"pro": 2, "team": 3}
+    pro, free = NoteFactory.create(), NoteFactory.create()
+    NoteFactory.create_batch(3, user=pro.user)
+    NoteFactory.create(user=free.user)
+    pro.user.groups.add(Group.objects.create(name="pro"))
+
+    claimed = _claim_notes(_get_pending_notes(), "token")
+
+    assert sorted(note.user_id for note in claimed) == sorted(
+        [pro.user_id, pro.user_id, free.user_id]
+    )
+
+
+def test_notes_without_credentials_are_parked_in_one_update():
+    notes = NoteFactory.create_batch(3)
+    user_id = notes[0].user_id
+    Note.objects.filter(id__in=[note.id for note in notes]).update(user_id=user_id)
+
+    with CaptureQueriesContext(connection) as queries:
+        publish_user_tweets([user_id])
+
+    updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+    # The claim and the parking
+    assert len(updates) == 2  # noqa: PLR2004
+    assert set(Note.objects.values_list("status", flat=True)) == {"parked"}
+    assert not _get_pending_notes().exists()
+
+
+def test_notes_of_several_users_are_parked_in_one_update_per_user():
+    users = [NoteFactory.create().user for _ in range(2)]
+    for user in users:
+        NoteFactory.create_batch(2, user=user)
+
+    with CaptureQueriesContext(connection) as queries:
+        publish_user_tweets([user.id for user in users])
+
+    updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+    # The claim and the parking of each user
+    assert len(updates) == 3  # noqa: PLR2004
+    assert set(Note.objects.values_list("status", flat=True)) == {"parked"}
+
+
+def test_note_missing_one_platform_is_parked_without_retries():
+    credentials = NostrCredentialsFactory.create()
+    note = NoteFactory.create(
+        user=credentials.user, publish_to_x=True, publish_to_nostr=True
+    )
+
+    with (
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        mock.patch("xedule.app.tasks.retry_note.apply_async") as apply_async,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = _accept_everything
+        publish_user_tweets([credentials.user_id])
+
+    note.refresh_from_db()
+    assert note.status == "parked"
+    assert note.nostr_id
+    assert note.attempts == 0
+    apply_async.assert_not_called()
+
+
+def test_saving_credentials_unparks_notes(django_capture_on_commit_callbacks):
+    parked = NoteFactory.create(status="parked", last_error="No credentials")
+    partial = NoteFactory.create(user=parked.user, status="parked", nostr_id="a" * 64)
+
+    with (
+        mock.patch("xedule.app.signals.publish_user_tweets.delay") as delay,
+        django_capture_on_commit_callbacks(execute=True),
+    ):
+        TwitterCredentialsFactory.create(user=parked.user)
+
+    parked.refresh_from_db()
+    partial.refresh_from_db()
+    assert parked.status == "pending"
+    assert parked.last_error == ""
+    assert partial.status == "published_n"
+    delay.assert_called_once_with([parked.user_id])
+
+
+def test_run_out_of_time_continues_in_another_task(settings):
+    settings.PUBLISH_TIME_BUDGET = 0
+    users = [NostrCredentialsFactory.create().user for _ in range(2)]
+    first, second = (
+        NoteFactory.create(user=user, publish_to_x=False, publish_to_nostr=True)
+        for user in users
+    )
+
+    with (
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        mock.patch("xedule.app.tasks.continue_publish.apply_async") as apply_async,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = _accept_everything
+        publish_user_tweets([user.id for user in users])
+
+    first.refresh_from_db()
+    second.refresh_from_db()
+    assert first.status == "published"
+    assert second.status == "pending"
+    claim_token = second.claimed_by
+    assert claim_token
+    apply_async.assert_called_once_with((claim_token, None), queue=None)
+
+
+def test_run_out_of_time_stops_in_the_middle_of_a_group(settings):
+    settings.PUBLISH_TIME_BUDGET = 0
+    user = NostrCredentialsFactory.create().user
+    first, second = NoteFactory.create_batch(
+        2, user=user, publish_to_x=False, publish_to_nostr=True
+    )
+
+    with (
+        mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool,
+        mock.patch("xedule.app.tasks.continue_publish.apply_async") as apply_async,
+    ):
+        get_relay_pool.return_value.deliver.side_effect = _accept_everything
+        publish_user_tweets([user.id])
+
+    first.refresh_from_db()
+    second.refresh_from_db()
+    assert first.status == "published"
+    assert second.status == "pending"
+    assert second.claimed_by
+    apply_async.assert_called_once_with((second.claimed_by, None), queue=None)
+
+
+def test_continuations_drain_the_claimed_notes(settings):
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+    settings.PUBLISH_TIME_BUDGET = 0
+    users = [NostrCredentialsFactory.create().user for _ in range(3)]
+    for user in users:
+        NoteFactory.create(user=user, publish_to_x=False, publish_to_nostr=True)
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        deliver = get_relay_pool.return_value.deliver
+        deliver.side_effect = _accept_everything
+        publish_user_tweets([user.id for user in users])
+
+    assert deliver.call_count == 3  # noqa: PLR2004
+    assert not Note.objects.exclude(status="published").exists()
+
+
+def test_continuation_leaves_notes_whose_claim_expired():
+    now = timezone.now()
+    expired, live = (
+        NoteFactory.create(
+            user=NostrCredentialsFactory.create().user,
+            publish_to_x=False,
+            publish_to_nostr=True,
+            claimed_by="token",
+            claim_expires_at=claim_expires_at,
+        )
+        for claim_expires_at in [now - timedelta(seconds=1), now + timedelta(seconds=1)]
+    )
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        deliver = get_relay_pool.return_value.deliver
+        deliver.side_effect = _accept_everything
+        continue_publish("token")
+
+    deliver.assert_called_once()
+    live.refresh_from_db()
+    assert live.status == "published"
+    expired.refresh_from_db()
+    assert expired.status == "pending"
+    assert not expired.nostr_id
+
+
+def test_final_write_skips_notes_claimed_by_another_task():
+    credentials = NostrCredentialsFactory.create()
+    note = NoteFactory.create(
+        user=credentials.user, publish_to_x=False, publish_to_nostr=True
+    )
+
+    def deliver_late(routes, **kwargs):
+        # The claim expired meanwhile and another task took the note
+        Note.objects.filter(id=note.id).update(claimed_by="other")
+        return _accept_everything(routes)
+
+    with mock.patch("xedule.app.tasks.get_relay_pool") as get_relay_pool:
+        get_relay_pool.return_value.deliver.side_effect = deliver_late
+        publish_user_tweets([credentials.user_id])
+
+    note.refresh_from_db()
+    assert note.status == "pending"
+    assert note.claimed_by == "other"
@@ -0,0 +1,54 @@
+import pytest
+from django.utils import timezone
+
+from xedule.app import twitter
+from xedule.app.tests.factories import TwitterCredentialsFactory
+from xedule.app.twitter import clear_twitter_clients
+from xedule.app.twitter import get_twitter_client
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _clear_clients():
+    clear_twitter_clients()
+    yield
+    clear_twitter_clients()
+
+
+def test_client_is_reused_for_same_credentials():
+    credentials = TwitterCredentialsFactory.create()
+    assert get_twitter_client(credentials) is get_twitter_client(credentials)
+
+
+def test_client_is_replaced_when_credentials_change():
+    credentials = TwitterCredentialsFactory.create()
+    client = get_twitter_client(credentials)
+
+    credentials.access_token = f"{credentials.access_token}-rotated"
+    credentials.save()
+    new_client = get_twitter_client(credentials)
+
+    assert new_client is not client
+    assert new_client.access_token == credentials.access_token
+
+
+def test_clients_share_http_session():
+    first, second = TwitterCredentialsFactory.create_batch(2)
+    assert get_twitter_client(first).session is get_twitter_client(second).session
+
+
+def test_least_recently_used_client_is_evicted(monkeypatch):
+    monkeypatch.setattr(twitter, "CLIENT_CACHE_SIZE", 2)
+    first, second, third = TwitterCredentialsFactory.build_batch(3)
+    for pk, credentials in enumerate((first, second, third), start=1):
+        credentials.pk = pk
+        credentials.updated_at = timezone.now()
+
+    first_client = get_twitter_client(first)
+    get_twitter_client(second)
+    get_twitter_client(first)
+    get_twitter_client(third)
+
+    assert get_twitter_client(first) is first_client
+    assert list(twitter._clients) == [third.pk, first.pk]  # noqa: SLF001
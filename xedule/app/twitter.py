@@ -0,0 +1,76 @@
+"""Twitter API clients reused across the publish runs of a worker.
+
+Building a ``tweepy.Client`` also builds a new ``requests`` session, so every
+run used to open fresh TLS connections to the API. Clients are cached here per
+credentials and share one session, whose connection pool keeps the sockets
+alive between runs.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import requests
+import tweepy
+from requests.adapters import HTTPAdapter
+
+CLIENT_CACHE_SIZE = 256
+CONNECTION_POOL_SIZE = 10
+
+_clients: OrderedDict[int, tuple[datetime, tweepy.Client]] = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def _create_session():
+    """Build the HTTP session shared by every cached client."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=CONNECTION_POOL_SIZE,
+        pool_maxsize=CONNECTION_POOL_SIZE,
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+_session = _create_session()
+
+
+def create_twitter_client(credentials):
+    """Create a Twitter API client using user credentials."""
+    client = tweepy.Client(
+        consumer_key=credentials.api_key,
+        consumer_secret=credentials.api_secret_key,
+        access_token=credentials.access_token,
+        access_token_secret=credentials.access_token_secret,
+        # The raw response carries the rate limit headers
+        return_type=requests.Response,
+    )
+    client.session = _session
+    return client
+
+
+def get_twitter_client(credentials):
+    """Return the cached client for the credentials, creating it if needed.
+
+    Cached clients are tied to the ``updated_at`` of their credentials, so a
+    client built from credentials that were edited since is replaced. The
+    least recently used clients are evicted beyond CLIENT_CACHE_SIZE.
+    """
+    with _clients_lock:
+        cached = _clients.get(credentials.pk)
+        if cached is not None and cached[0] == credentials.updated_at:
+            _clients.move_to_end(credentials.pk)
+            return cached[1]
+
+        client = create_twitter_client(credentials)
+        _clients[credentials.pk] = (credentials.updated_at, client)
+        _clients.move_to_end(credentials.pk)
+        while len(_clients) > CLIENT_CACHE_SIZE:
+            _clients.popitem(last=False)
+        return client
+
+
+def clear_twitter_clients():
+    """Drop every cached client."""
+    with _clients_lock:
+        _clients.clear()